@@ -0,0 +1,221 @@
+import copy
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from recipes.models import Ingredient, Recipe, Tag
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .authentication import token_cache
+from .cache import CACHE_TIMEOUT, cache_timeout
+from .filters import IngredientFilter, RecipeFilter
+from .mixins import response_cache_key, response_etag
+from .pagination import FeedPagination
+from .serializers import IngredientSerializer, TagSerializer
+from .views import (IngredientViewSet, RecipeViewSet, TagViewSet,
+                    get_recipes_data)
+
+HTTP_METHODS = ('get', 'post', 'put', 'patch', 'delete', 'head', 'options')
+
+
+async def authenticate(request):
+    '''Пользователь по токену из заголовка или анонимный пользователь.
+    None, если аутентификацию нужно оставить DRF: сессия
+    или неверный токен. Токены берутся из того же кэша,
+    что и в CachedTokenAuthentication.
+    '''
+    header = request.headers.get('Authorization')
+    if header is None:
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return None
+        return AnonymousUser()
+    keyword, _, key = header.partition(' ')
+    if keyword != 'Token' or not key:
+        return None
+    cached = await token_cache.aget(key)
+    if cached is not None:
+        return cached[0]
+    try:
+        token = await Token.objects.select_related('user').aget(key=key)
+    except Token.DoesNotExist:
+        return None
+    if not token.user.is_active:
+        return None
+    await token_cache.aset(key, token.user, token)
+    return copy.copy(token.user)
+
+
+def json_response(view, data, status=200, headers=None):
+    '''Ответ с тем же JSON и заголовками, что отдаёт DRF.'''
+    response = HttpResponse(
+        b'' if data is None else JSONRenderer().render(data),
+        content_type='application/json',
+        status=status,
+        headers=headers,
+    )
+    response['Allow'] = ', '.join(
+        method.upper() for method in HTTP_METHODS
+        if method in view.actions or method in ('head', 'options')
+    )
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def async_read(viewset, actions, **initkwargs):
+    '''Асинхронно обслуживает GET запросы JSON, а остальные запросы,
+    сессии и браузерный API передаёт
+    синхронному представлению viewset. Обработчик тоже может вернуть
+    None, чтобы отдать запрос DRF, например для ответа с ошибкой.
+    '''
+    fallback = viewset.as_view(actions, **initkwargs)
+    sync_fallback = sync_to_async(fallback)
+
+    def decorator(handler):
+        async def view(request, *args, **kwargs):
+            if (
+                request.method == 'GET'
+                and 'format' not in request.GET
+                and 'text/html' not in request.headers.get('Accept', '')
+            ):
+                user = await authenticate(request)
+                if user is not None:
+                    request.user = user
+                    response = await handler(
+                        view, request, *args, **kwargs
+                    )
+                    if response is not None:
+                        if not user.is_authenticated:
+                            patch_vary_headers(response, ['Cookie'])
+                        return response
+            return await sync_fallback(request, *args, **kwargs)
+
+        view.cls = fallback.cls
+        view.actions = fallback.actions
+        view.initkwargs = fallback.initkwargs
+        view.csrf_exempt = True
+        return view
+
+    return decorator
+
+
+async def cached_response(view, request, model, build):
+    '''Отдаёт список из того же кэша и с тем же ETag,
+    что и CachedResponseMixin.
+    '''
+    cache_key = await sync_to_async(response_cache_key)(
+        model, 'list', '', request.GET,
+    )
+    data = await cache.aget(cache_key)
+    if data is None:
+        data = await build()
+        if data is None:
+            return None
+        await cache.aset(cache_key, data, cache_timeout(CACHE_TIMEOUT))
+    etag = response_etag(JSONRenderer.media_type, data)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return json_response(view, None, 304, {'ETag': etag})
+    return json_response(view, data, headers={'ETag': etag})
+
+
+@async_read(RecipeViewSet, {'get': 'list', 'post': 'create'},
+            basename='recipes', detail=False)
+async def recipe_list(view, request):
+    '''Список рецептов с фильтрами и постраничной пагинацией.
+    Курсорная пагинация и ошибки обрабатываются синхронным DRF.
+    '''
+    page_number = request.GET.get('page', '1')
+    if 'cursor' in request.GET or not page_number.isdigit():
+        return None
+    page_number = int(page_number)
+    drf_request = Request(request)
+    drf_request.user = request.user
+
+    def filter_queryset():
+        filterset = RecipeFilter(
+            request.GET,
+            queryset=Recipe.objects.only('pk'),
+            request=drf_request,
+        )
+        return filterset.qs if filterset.is_valid() else None
+
+    queryset = await sync_to_async(filter_queryset)()
+    if queryset is None:
+        return None
+    page_size = FeedPagination().get_page_size(drf_request)
+    count = await queryset.acount()
+    num_pages = max(math.ceil(count / page_size), 1)
+    if not 1 <= page_number <= num_pages:
+        return None
+    offset = (page_number - 1) * page_size
+    pks = [
+        pk async for pk in queryset.values_list(
+            'pk', flat=True,
+        )[offset:offset + page_size].aiterator()
+    ]
+    results = await sync_to_async(get_recipes_data)(drf_request, pks)
+    url = request.build_absolute_uri()
+    next_link = previous_link = None
+    if page_number < num_pages:
+        next_link = replace_query_param(url, 'page', page_number + 1)
+    if page_number == 2:
+        previous_link = remove_query_param(url, 'page')
+    elif page_number > 2:
+        previous_link = replace_query_param(url, 'page', page_number - 1)
+    return json_response(view, {
+        'count': count,
+        'next': next_link,
+        'previous': previous_link,
+        'results': results,
+    })
+
+
+@async_read(RecipeViewSet, {'get': 'retrieve', 'put': 'update',
+                            'patch': 'partial_update', 'delete': 'destroy'},
+            basename='recipes', detail=True)
+async def recipe_detail(view, request, pk):
+    '''Рецепт по id. Ответ 404 и запросы с фильтрами отдаёт
+    синхронный DRF.
+    '''
+    if request.GET or not await Recipe.objects.filter(pk=pk).aexists():
+        return None
+    drf_request = Request(request)
+    drf_request.user = request.user
+    data = await sync_to_async(get_recipes_data)(drf_request, [int(pk)])
+    return json_response(view, data[0])
+
+
+@async_read(IngredientViewSet, {'get': 'list'},
+            basename='ingredients', detail=False)
+async def ingredient_list(view, request):
+    '''Поиск ингредиентов по названию.'''
+    async def build():
+        filterset = IngredientFilter(
+            request.GET, queryset=Ingredient.objects.all(),
+        )
+        if not filterset.is_valid():
+            return None
+        return [
+            IngredientSerializer(ingredient).data
+            async for ingredient in filterset.qs.aiterator()
+        ]
+
+    return await cached_response(view, request, Ingredient, build)
+
+
+@async_read(TagViewSet, {'get': 'list'}, basename='tags', detail=False)
+async def tag_list(view, request):
+    '''Список тегов.'''
+    async def build():
+        return [
+            TagSerializer(tag).data async for tag in Tag.objects.aiterator()
+        ]
+
+    return await cached_response(view, request, Tag, build)
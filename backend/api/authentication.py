@@ -0,0 +1,141 @@
+import copy
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+
+from .cache import new_version
+
+
+def version_key(user_id):
+    return f'version:auth:{user_id}'
+
+
+def bump_version(user_id):
+    '''Делает устаревшими записи пользователя в token_cache всех
+    процессов после коммита текущей транзакции.
+    '''
+    key = version_key(user_id)
+    transaction.on_commit(
+        lambda: cache.set(key, new_version(), timeout=None)
+    )
+
+
+class TokenCache:
+    '''Ограниченный LRU кэш токен -> (пользователь, токен) в памяти
+    процесса. Вместе с записью хранится версия пользователя из общего
+    кэша Django, при каждом попадании она сверяется с текущей.
+    Сигналы меняют версию при удалении токена и изменении пользователя,
+    так что записи сбрасываются сразу во всех воркерах. Записи живут
+    не дольше ttl секунд. Индекс user_keys (id пользователя -> ключи)
+    позволяет удалить записи пользователя, не обходя весь кэш.
+    '''
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.user_keys = defaultdict(set)
+
+    def lookup(self, key):
+        '''Запись процесса (пользователь, токен, версия) или None.'''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            user, token, version, expires = entry
+            if expires < time.monotonic():
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+        return user, token, version
+
+    def checked(self, key, entry, version):
+        '''Копия закэшированной пары, чтобы запросы в разных потоках
+        не делили один объект пользователя. None, если версия устарела.
+        '''
+        user, token, cached_version = entry
+        if version != cached_version:
+            with self.lock:
+                self.remove(key)
+            return None
+        return copy.copy(user), token
+
+    def get(self, key):
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        return self.checked(key, entry, cache.get(version_key(entry[0].pk)))
+
+    async def aget(self, key):
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        version = await cache.aget(version_key(entry[0].pk))
+        return self.checked(key, entry, version)
+
+    def remove(self, key):
+        '''Удаляет запись и её ключ из индекса. Вызывается под lock.'''
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[0].pk
+        keys = self.user_keys[user_id]
+        keys.discard(key)
+        if not keys:
+            del self.user_keys[user_id]
+
+    def store(self, key, user, token, version):
+        if not self.maxsize or not self.ttl:
+            return
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = (
+                user, token, version, time.monotonic() + self.ttl,
+            )
+            self.user_keys[user.pk].add(key)
+            while len(self.entries) > self.maxsize:
+                self.remove(next(iter(self.entries)))
+
+    def set(self, key, user, token):
+        version = cache.get_or_set(
+            version_key(user.pk), new_version, timeout=None,
+        )
+        self.store(key, user, token, version)
+
+    async def aset(self, key, user, token):
+        version = await cache.aget_or_set(
+            version_key(user.pk), new_version, timeout=None,
+        )
+        self.store(key, user, token, version)
+
+    def invalidate(self, user_id):
+        '''Удаляет записи пользователя здесь и, через версию в общем
+        кэше, в остальных процессах.
+        '''
+        bump_version(user_id)
+        with self.lock:
+            for key in list(self.user_keys.get(user_id, ())):
+                self.remove(key)
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''TokenAuthentication без запроса Token + User к БД на каждый
+    вызов API, пока токен есть в token_cache.
+    '''
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return copy.copy(user), token
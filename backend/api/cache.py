@@ -0,0 +1,123 @@
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from foodgram.replicas import read_replica
+from recipes.models import Favorite, ShoppingCart, Tag
+from users.models import Follow
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+USER_RELATION_FIELDS = {
+    Favorite: 'recipe_id',
+    ShoppingCart: 'recipe_id',
+    Follow: 'author_id',
+}
+
+
+def cache_timeout(timeout=CACHE_TIMEOUT):
+    '''Время жизни записи кэша. Прочитанное с реплики может отставать
+    от основной БД, поэтому хранится не дольше REPLICA_STICKY_SECONDS.
+    '''
+    if read_replica.get() is None:
+        return timeout
+    return min(timeout, settings.REPLICA_STICKY_SECONDS)
+
+
+def version_key(model):
+    return f'version:{model._meta.label_lower}'
+
+
+def new_version():
+    '''Новая версия для ключей кэша: время и случайная часть. Версия,
+    потерянная при вытеснении из кэша, не начинается заново с какого-то
+    значения по умолчанию, поэтому не совпадёт ни с одной из прежних
+    и не откроет записи, закэшированные под ними.
+    '''
+    return f'{time.time_ns():x}.{secrets.token_hex(4)}'
+
+
+def init_version(key, timeout=None):
+    '''Версия по ключу key. Если её нет, записывается новая через add,
+    чтобы параллельные запросы сошлись на одной версии.
+    '''
+    version = new_version()
+    if cache.add(key, version, timeout=timeout):
+        return version
+    return cache.get(key, version)
+
+
+def get_version(model):
+    '''Текущая версия данных модели для ключей кэша.'''
+    key = version_key(model)
+    return cache.get(key) or init_version(key)
+
+
+def bump_version(model):
+    '''Меняет версию данных модели, делая устаревшими старые ключи кэша.
+    Внутри транзакции версия меняется после коммита, иначе параллельный
+    запрос успеет закэшировать старые данные под новой версией.
+    '''
+    transaction.on_commit(
+        lambda: cache.set(version_key(model), new_version(), timeout=None)
+    )
+
+
+def get_tag_ids():
+    '''Словарь id тегов по их slug.'''
+    key = f'tag_ids:{get_version(Tag)}'
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'pk'))
+        cache.set(key, tag_ids, cache_timeout())
+    return tag_ids
+
+
+def recipe_version_key(pk):
+    return f'version:recipes.recipe:{pk}'
+
+
+def get_recipe_versions(pks):
+    '''Версии закэшированных представлений рецептов по их id.'''
+    keys = {recipe_version_key(pk): pk for pk in pks}
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = init_version(key, CACHE_TIMEOUT)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def invalidate_recipes(*pks):
+    '''Делает устаревшими закэшированные представления рецептов
+    после коммита текущей транзакции.
+    '''
+    keys = [recipe_version_key(pk) for pk in pks]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def user_relation_key(user_id, model):
+    return f'user:{user_id}:{model._meta.model_name}'
+
+
+def get_user_relation_ids(user, model):
+    '''Множество id рецептов или авторов, связанных с пользователем.
+    model — одна из моделей USER_RELATION_FIELDS.
+    '''
+    if not user.is_authenticated:
+        return set()
+    key = user_relation_key(user.pk, model)
+    ids = cache.get(key)
+    if ids is None:
+        ids = set(model.objects.filter(user=user).values_list(
+            USER_RELATION_FIELDS[model], flat=True,
+        ))
+        cache.set(key, ids, cache_timeout())
+    return ids
+
+
+def invalidate_user_relation(user_id, model):
+    '''Сбрасывает кэш связей пользователя после коммита транзакции.'''
+    key = user_relation_key(user_id, model)
+    transaction.on_commit(lambda: cache.delete(key))
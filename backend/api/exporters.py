@@ -0,0 +1,59 @@
+import csv
+import json
+
+from recipes.models import ShoppingListItem
+
+CHUNK_SIZE = 2000
+
+
+def shopping_cart_ingredients(user):
+    '''Читает сводный список покупок пользователя без агрегации.'''
+    return ShoppingListItem.objects.filter(user=user).order_by(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+    ).values_list(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'amount',
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+def export_txt(ingredients):
+    yield 'Список покупок:\n'
+    for name, measurement_unit, amount in ingredients:
+        yield f'{name} — {amount} {measurement_unit}\n'
+
+
+class _Echo:
+    '''Буфер для csv.writer, который сразу возвращает записанную строку.'''
+
+    def write(self, value):
+        return value
+
+
+def export_csv(ingredients):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in ingredients:
+        yield writer.writerow(row)
+
+
+def export_json(ingredients):
+    yield '['
+    separator = ''
+    for name, measurement_unit, amount in ingredients:
+        item = json.dumps({
+            'name': name,
+            'measurement_unit': measurement_unit,
+            'amount': amount,
+        }, ensure_ascii=False)
+        yield f'{separator}{item}'
+        separator = ','
+    yield ']'
+
+
+EXPORTERS = {
+    'txt': export_txt,
+    'csv': export_csv,
+    'json': export_json,
+}
@@ -1,15 +1,105 @@
 import base64
+import binascii
+import hashlib
+import os
 
-from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
 from rest_framework import serializers
 
+from .images import VARIANTS, variant_name
+
+BASE64_CHUNK_SIZE = 64 * 1024
+
 
 class Base64ImageField(serializers.ImageField):
     '''Поле сериализатора для изображений в base64.'''
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(data)
+            if name := self.existing_name(data):
+                data.close()
+                return name
 
         return super().to_internal_value(data)
+
+    def existing_name(self, file):
+        '''Имя уже сохранённого файла с тем же содержимым.
+        Такой файл не нужно ни проверять, ни записывать повторно.
+        Время изменения файла обновляется, чтобы collect_images
+        не удалил его, пока новый рецепт со ссылкой на него не сохранён.
+        '''
+        model_field = self.parent.Meta.model._meta.get_field(self.source)
+        storage = model_field.storage
+        name = model_field.generate_filename(None, file.name)
+        if not storage.exists(name):
+            return None
+        try:
+            os.utime(storage.path(name))
+        except NotImplementedError:
+            pass
+        except FileNotFoundError:
+            return None
+        return name
+
+    def decode(self, data):
+        '''Декодирует base64 по частям во временный файл на диске.
+        Файл называется по sha256 содержимого.
+        '''
+        header, _, imgstr = data.partition(';base64,')
+        # Тип в заголовке регистронезависим: data:image/PNG и
+        # data:image/png должны давать одно имя файла.
+        header = header.lower()
+        # Клиенты переносят длинный base64 по строкам.
+        imgstr = ''.join(imgstr.split())
+        ext = header.split('/')[-1]
+        file = TemporaryUploadedFile(
+            name='temp.' + ext,
+            content_type=header[len('data:'):],
+            size=None,
+            charset=None,
+        )
+        digest = hashlib.sha256()
+        try:
+            for start in range(0, len(imgstr), BASE64_CHUNK_SIZE):
+                chunk = base64.b64decode(
+                    imgstr[start:start + BASE64_CHUNK_SIZE], validate=True,
+                )
+                digest.update(chunk)
+                file.write(chunk)
+        except binascii.Error:
+            file.close()
+            self.fail('invalid_image')
+        file.size = file.tell()
+        file.seek(0)
+        file.name = f'{digest.hexdigest()}.{ext}'
+        return file
+
+
+def image_variants(name, original_url, request=None):
+    '''Ссылки на варианты изображения name.
+    Пока вариант не создан, отдаётся ссылка на оригинал.
+    '''
+    # Варианты создаются вместе и по порядку VARIANTS,
+    # поэтому достаточно проверить последний.
+    ready = default_storage.exists(variant_name(name, list(VARIANTS)[-1]))
+    variants = {}
+    for variant in VARIANTS:
+        if ready:
+            url = default_storage.url(variant_name(name, variant))
+        else:
+            url = original_url
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        variants[variant] = url
+    return variants
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    '''Ссылки на уменьшенные варианты изображения.'''
+    def to_representation(self, value):
+        if not value:
+            return None
+        return image_variants(
+            value.name, value.url, self.context.get('request'),
+        )
@@ -1,15 +1,19 @@
+from django.db.models import Case, Exists, IntegerField, OuterRef, When
+from django.utils.functional import cached_property
 from django_filters import rest_framework as filters
 
-from recipes.models import Recipe, Ingredient, Tag
+from recipes.models import Recipe, Ingredient
+
+from .cache import get_tag_ids
+
+INGREDIENTS_SEARCH_LIMIT = 50
 
 
 class RecipeFilter(filters.FilterSet):
     '''Класс фильтров для предоставления Recipe.'''
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
-        conjoined=True,
+    tags = filters.MultipleChoiceFilter(
+        field_name='tags',
+        method='with_all_tags',
     )
     author = filters.NumberFilter(
         field_name='author__pk',
@@ -24,6 +28,32 @@ class RecipeFilter(filters.FilterSet):
         method='in_shopping_cart',
     )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Функция, а не метод: форма копирует choices через deepcopy,
+        # а у метода скопировался бы и сам FilterSet с запросом.
+        self.filters['tags'].extra['choices'] = lambda: [
+            (slug, slug) for slug in self.tag_ids
+        ]
+
+    @cached_property
+    def tag_ids(self):
+        '''Словарь тегов читается один раз за запрос, чтобы допустимые
+        slug и их id не разошлись при смене версии тегов.
+        '''
+        return get_tag_ids()
+
+    def with_all_tags(self, queryset, name, value):
+        '''Оставляет рецепты, у которых есть все выбранные теги.'''
+        if not value:
+            return queryset
+        recipe_tags = Recipe.tags.through.objects
+        for tag_id in sorted({self.tag_ids[slug] for slug in value}):
+            queryset = queryset.filter(Exists(recipe_tags.filter(
+                recipe_id=OuterRef('pk'), tag_id=tag_id,
+            )))
+        return queryset
+
     def in_favorited(self, queryset, name, value):
         if value and not self.request.user.is_authenticated:
             return queryset.none()
@@ -49,9 +79,21 @@ class IngredientFilter(filters.FilterSet):
     '''Класс фильтров для предоставления Ingredient.'''
     name = filters.CharFilter(
         field_name='name',
-        lookup_expr='istartswith',
+        method='search_name',
     )
 
+    def search_name(self, queryset, name, value):
+        '''Ищет ингредиенты по вхождению в название.
+        Сначала идут совпадения с начала названия, затем остальные.
+        '''
+        return queryset.filter(name__icontains=value).annotate(
+            prefix_rank=Case(
+                When(name__istartswith=value, then=0),
+                default=1,
+                output_field=IntegerField(),
+            ),
+        ).order_by('prefix_rank', 'name')[:INGREDIENTS_SEARCH_LIMIT]
+
     class Meta:
         model = Ingredient
         fields = ['name']
@@ -0,0 +1,89 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .cache import invalidate_recipes
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = {
+    'thumbnail': 480,
+    'webp': 1600,
+}
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_WORKERS,
+    thread_name_prefix='images',
+)
+pending = set()
+pending_lock = threading.Lock()
+
+
+def variant_name(name, variant):
+    '''Имя файла варианта изображения.
+    Строится из имени оригинала, которое содержит хэш его содержимого.
+    '''
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}_{variant}.webp')
+
+
+def missing_variants(image):
+    return [
+        variant for variant in VARIANTS
+        if not default_storage.exists(variant_name(image.name, variant))
+    ]
+
+
+def make_variants(storage, name, recipe_pk=None):
+    '''Создаёт уменьшенные webp варианты изображения.
+    Оригинал читается из storage, варианты пишутся в default_storage
+    под именами, производными от имени оригинала.
+    '''
+    with storage.open(name) as file, Image.open(file) as image:
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        for variant, size in VARIANTS.items():
+            path = variant_name(name, variant)
+            if default_storage.exists(path):
+                continue
+            resized = image.copy()
+            resized.thumbnail((size, size))
+            buffer = BytesIO()
+            resized.save(buffer, 'WEBP', quality=80)
+            if not default_storage.exists(path):
+                default_storage.save(path, ContentFile(buffer.getvalue()))
+    if recipe_pk is not None:
+        invalidate_recipes(recipe_pk)
+
+
+def schedule_variants(recipe):
+    '''Ставит создание вариантов изображения рецепта в очередь.
+    Одно изображение не обрабатывается в нескольких потоках сразу.
+    '''
+    name = recipe.image.name
+    if not name or not missing_variants(recipe.image):
+        return
+    with pending_lock:
+        if name in pending:
+            return
+        pending.add(name)
+    future = executor.submit(
+        make_variants, recipe.image.storage, name, recipe.pk,
+    )
+    future.add_done_callback(lambda future: finish(future, name))
+
+
+def finish(future, name):
+    with pending_lock:
+        pending.discard(name)
+    if future.exception() is not None:
+        logger.error('Не удалось создать варианты изображения %s', name,
+                     exc_info=future.exception())
@@ -0,0 +1,252 @@
+import base64
+import io
+import json
+import statistics
+import subprocess
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import override_settings
+from PIL import Image
+from recipes.models import Ingredient, Recipe, Tag
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import User
+
+
+LOCAL_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class QueryCounter:
+    '''Считает запросы к БД. CaptureQueriesContext здесь не подходит:
+    сигнал request_started очищает connection.queries.
+    '''
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def png_data_url():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), '#e26c2d').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    '''Измеряет задержку, пропускную способность и число запросов к БД
+    для основных сценариев API. Запросы выполняются в процессе через
+    APIClient с токеном в заголовке, все изменения данных откатываются.
+    Изображения на время замера пишутся во временный каталог, а кэш
+    заменяется локальным: иначе в них остались бы файлы и версии
+    откаченных объектов. Данные для замеров можно создать командой
+    generate_data.
+    Результаты пишутся в JSON, чтобы сравнивать их между коммитами.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--batch', type=int, default=10,
+                            help='Рецептов в пакетных сценариях')
+        parser.add_argument('--only', nargs='*',
+                            help='Запустить только указанные сценарии')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+        parser.add_argument('--compare',
+                            help='Файл с прошлыми результатами в JSON')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as media_root:
+            try:
+                with transaction.atomic(), override_settings(
+                    ALLOWED_HOSTS=['testserver'],
+                    MEDIA_ROOT=media_root,
+                    CACHES=LOCAL_CACHES,
+                ):
+                    results = self.run(options)
+                    raise Rollback
+            except Rollback:
+                pass
+        report = {
+            'revision': revision(),
+            'vendor': connection.vendor,
+            'recipes': Recipe.objects.count(),
+            'users': User.objects.count(),
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        previous = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                previous = json.load(file)['results']
+        self.print_table(results, previous)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    def run(self, options):
+        user = User.objects.annotate(
+            cart=Count('shopping_cart', distinct=True),
+            follows=Count('follower', distinct=True),
+        ).filter(recipes__isnull=False).order_by('-cart', '-follows').first()
+        if user is None:
+            raise SystemExit('Нет рецептов, запустите generate_data')
+        token, created = Token.objects.get_or_create(user=user)
+        anonymous = APIClient()
+        client = APIClient(HTTP_AUTHORIZATION=f'Token {token.key}')
+        recipe = Recipe.objects.filter(author=user).latest('pk')
+        slugs = list(Tag.objects.annotate(
+            recipes_count=Count('recipes'),
+        ).order_by('-recipes_count').values_list('slug', flat=True)[:2])
+        ingredient_ids = list(Ingredient.objects.filter(
+            ingredientamount__isnull=False,
+        ).distinct().values_list('pk', flat=True)[:6])
+        tag_ids = list(Tag.objects.values_list('pk', flat=True)[:2])
+        image = png_data_url()
+        cart_ids = list(Recipe.objects.exclude(
+            shopping_cart__user=user,
+        ).values_list('pk', flat=True)[:options['batch']])
+        counter = iter(range(10 ** 9))
+
+        def recipe_data():
+            number = next(counter)
+            return {
+                'name': f'Замер {number}',
+                'text': 'Рецепт для замера',
+                'cooking_time': number % 100 + 1,
+                'image': image,
+                'tags': tag_ids,
+                'ingredients': [
+                    {'id': pk, 'amount': number % 50 + i + 1}
+                    for i, pk in enumerate(ingredient_ids)
+                ],
+            }
+
+        scenarios = {
+            'recipes_list_anonymous': (anonymous, 'get', '/api/recipes/',
+                                       None),
+            'users_me': (client, 'get', '/api/users/me/', None),
+            'recipes_list': (client, 'get', '/api/recipes/', None),
+            'recipes_list_cursor': (client, 'get', '/api/recipes/?cursor=',
+                                    None),
+            'recipe_detail': (client, 'get', f'/api/recipes/{recipe.pk}/',
+                              None),
+            'filter_tags': (client, 'get', '/api/recipes/?' + '&'.join(
+                f'tags={slug}' for slug in slugs
+            ), None),
+            'filter_author': (client, 'get',
+                              f'/api/recipes/?author={user.pk}', None),
+            'filter_favorited': (client, 'get',
+                                 '/api/recipes/?is_favorited=1', None),
+            'filter_shopping_cart': (client, 'get',
+                                     '/api/recipes/?is_in_shopping_cart=1',
+                                     None),
+            'ingredients_search': (client, 'get', '/api/ingredients/?name=а',
+                                   None),
+            'subscriptions': (client, 'get', '/api/users/subscriptions/',
+                              None),
+            'shopping_list': (client, 'get', '/api/recipes/shopping_list/',
+                              None),
+            'download_shopping_cart': (
+                client, 'get', '/api/recipes/download_shopping_cart/', None,
+            ),
+            'recipe_create': (client, 'post', '/api/recipes/', recipe_data),
+            'recipe_update': (client, 'patch', f'/api/recipes/{recipe.pk}/',
+                              recipe_data),
+            'shopping_cart_single': [
+                (client, method, f'/api/recipes/{pk}/shopping_cart/', None)
+                for method in ('post', 'delete') for pk in cart_ids
+            ],
+            'shopping_cart_batch': [
+                (client, method, '/api/recipes/shopping_cart/batch/',
+                 lambda: {'ids': cart_ids})
+                for method in ('post', 'delete')
+            ],
+        }
+        if options['only']:
+            scenarios = {
+                name: scenario for name, scenario in scenarios.items()
+                if name in options['only']
+            }
+        return {
+            name: self.measure(scenario, options)
+            for name, scenario in scenarios.items()
+        }
+
+    def measure(self, steps, options):
+        '''Замеряет сценарий из одного запроса или их последовательности.'''
+        if isinstance(steps, tuple):
+            steps = [steps]
+
+        def call():
+            for client, method, url, data in steps:
+                response = getattr(client, method)(
+                    url, data and data(), format='json',
+                )
+                if hasattr(response, 'streaming_content'):
+                    b''.join(response.streaming_content)
+            return response
+
+        for _ in range(options['warmup']):
+            call()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            response = call()
+        timings = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return {
+            'status': response.status_code,
+            'queries': queries.count,
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'p50_ms': round(timings[len(timings) // 2], 2),
+            'p95_ms': round(timings[int(len(timings) * 0.95)], 2),
+            'max_ms': round(timings[-1], 2),
+            'rps': round(1000 * len(timings) / sum(timings), 1),
+        }
+
+    def print_table(self, results, previous=None):
+        for name, result in results.items():
+            line = (
+                f'{name:<26} {result["status"]} '
+                f'запросов {result["queries"]:>3}  '
+                f'p50 {result["p50_ms"]:>8.2f} мс  '
+                f'p95 {result["p95_ms"]:>8.2f} мс  '
+                f'{result["rps"]:>8.1f} зап/с'
+            )
+            if previous and name in previous:
+                before = previous[name]
+                line += (
+                    f'  (было p50 {before["p50_ms"]:.2f} мс, '
+                    f'запросов {before["queries"]})'
+                )
+            self.stdout.write(line)
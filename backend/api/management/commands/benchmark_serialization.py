@@ -0,0 +1,106 @@
+import json
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from recipes.models import Recipe
+from rest_framework.renderers import JSONRenderer
+
+from api.representations import recipes_representation
+from api.serializers import RecipeSerializer
+
+from .benchmark_api import revision
+
+
+def serializer_data(pks, request):
+    '''Представления рецептов через RecipeSerializer, как раньше.'''
+    return RecipeSerializer(
+        Recipe.objects.with_related_for_api(request.user).filter(pk__in=pks),
+        many=True,
+        context={'request': request},
+    ).data
+
+
+class Command(BaseCommand):
+    '''Сравнивает сборку представлений рецептов через RecipeSerializer
+    и recipes_representation вместе с запросами к БД, без кэша.
+    Проверяет, что JSON обоих вариантов совпадает побайтно.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100,
+                            help='Рецептов в одном замере')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--verify-all', action='store_true',
+                            help='Сравнить JSON всех рецептов в БД')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+
+    def handle(self, *args, **options):
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            request = RequestFactory().get('/api/recipes/')
+            request.user = AnonymousUser()
+            pks = list(Recipe.objects.values_list(
+                'pk', flat=True,
+            )[:options['recipes']])
+            if not pks:
+                raise CommandError('Нет рецептов, запустите generate_data')
+            self.verify(pks, request)
+            if options['verify_all']:
+                all_pks = list(Recipe.objects.values_list('pk', flat=True))
+                for start in range(0, len(all_pks), 500):
+                    self.verify(all_pks[start:start + 500], request)
+                self.stdout.write(
+                    f'JSON совпадает для {len(all_pks)} рецептов'
+                )
+            results = {
+                name: self.measure(build, pks, request, options['repeat'])
+                for name, build in (
+                    ('serializer', serializer_data),
+                    ('representation', recipes_representation),
+                )
+            }
+        speedup = (
+            results['serializer']['p50_ms']
+            / results['representation']['p50_ms']
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<15} p50 {result["p50_ms"]:>8.2f} мс  '
+                f'p95 {result["p95_ms"]:>8.2f} мс'
+            )
+        self.stdout.write(f'ускорение {speedup:.1f}x на {len(pks)} рецептах')
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    'revision': revision(),
+                    'recipes': len(pks),
+                    'repeat': options['repeat'],
+                    'results': results,
+                    'speedup': round(speedup, 2),
+                }, file, ensure_ascii=False, indent=2)
+
+    def verify(self, pks, request):
+        renderer = JSONRenderer()
+        expected = renderer.render(serializer_data(pks, request))
+        actual = renderer.render(recipes_representation(pks, request))
+        if expected != actual:
+            raise CommandError(
+                f'JSON отличается для рецептов {pks[0]}..{pks[-1]}'
+            )
+
+    def measure(self, build, pks, request, repeat):
+        build(pks, request)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            build(pks, request)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return {
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'p50_ms': round(timings[len(timings) // 2], 2),
+            'p95_ms': round(timings[int(len(timings) * 0.95)], 2),
+        }
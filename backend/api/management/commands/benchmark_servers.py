@@ -0,0 +1,190 @@
+import http.client
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import Recipe
+from rest_framework.authtoken.models import Token
+
+from .benchmark_api import revision
+
+MODES = {
+    'wsgi': 'False',
+    'asgi': 'True',
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    '''Сравнивает пропускную способность gunicorn с синхронными
+    воркерами (WSGI) и с воркерами uvicorn (ASGI, ASYNC_API)
+    при одинаковом числе воркеров. Каждый сервер запускается
+    на свободном порту, нагрузку создают потоки с постоянными
+    соединениями, которые по кругу запрашивают список рецептов,
+    рецепт, поиск ингредиентов и теги. Через --env серверам можно
+    передать настройки, например DB_CONN_MAX_AGE=0, чтобы сравнить
+    их влияние.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--threads', type=int, default=1)
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Одновременных клиентов')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Длительность замера в секундах')
+        parser.add_argument('--warmup', type=float, default=2)
+        parser.add_argument('--modes', nargs='*', choices=MODES,
+                            default=list(MODES))
+        parser.add_argument('--env', nargs='*', default=[],
+                            metavar='NAME=VALUE',
+                            help='Переменные окружения для серверов, '
+                                 'например DB_CONN_MAX_AGE=0')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+
+    def handle(self, *args, **options):
+        recipe = Recipe.objects.select_related('author').last()
+        if recipe is None:
+            raise CommandError('Нет рецептов, запустите generate_data')
+        token, created = Token.objects.get_or_create(user=recipe.author)
+        authorized = {'Authorization': f'Token {token.key}'}
+        paths = [
+            ('/api/recipes/', authorized),
+            ('/api/recipes/', {}),
+            (f'/api/recipes/{recipe.pk}/', authorized),
+            ('/api/ingredients/?name=' + quote('а'), {}),
+            ('/api/tags/', {}),
+        ]
+        try:
+            results = {
+                mode: self.run(mode, paths, options)
+                for mode in options['modes']
+            }
+        finally:
+            if created:
+                token.delete()
+        report = {
+            'revision': revision(),
+            'workers': options['workers'],
+            'threads': options['threads'],
+            'env': options['env'],
+            'concurrency': options['concurrency'],
+            'duration': options['duration'],
+            'results': results,
+        }
+        for mode, result in results.items():
+            self.stdout.write(
+                f'{mode:<5} {result["rps"]:>8.1f} зап/с  '
+                f'p50 {result["p50_ms"]:>8.2f} мс  '
+                f'p95 {result["p95_ms"]:>8.2f} мс  '
+                f'запросов {result["requests"]}  '
+                f'ошибок {result["errors"]}'
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    def run(self, mode, paths, options):
+        port = free_port()
+        server = subprocess.Popen(
+            ['gunicorn', '--workers', str(options['workers']),
+             '--threads', str(options['threads']),
+             '--bind', f'127.0.0.1:{port}'],
+            cwd=settings.BASE_DIR,
+            env={
+                **os.environ,
+                **dict(item.split('=', 1) for item in options['env']),
+                'ASYNC_API': MODES[mode],
+            },
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            self.wait_ready(server, port)
+            self.load(port, paths, options['concurrency'], options['warmup'])
+            return self.load(
+                port, paths, options['concurrency'], options['duration'],
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+    def wait_ready(self, server, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('gunicorn не запустился')
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port)
+                connection.request('GET', '/api/tags/', headers=self.host())
+                connection.getresponse().read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError('gunicorn не ответил за отведённое время')
+
+    def host(self):
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else None
+        return {'Host': host if host and host != '*' else 'localhost'}
+
+    def load(self, port, paths, concurrency, duration):
+        '''Нагружает сервер в concurrency потоков в течение duration
+        секунд и возвращает пропускную способность и задержки.
+        '''
+        timings = []
+        errors = []
+        deadline = time.monotonic() + duration
+
+        def client(offset):
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            step = offset
+            while time.monotonic() < deadline:
+                path, headers = paths[step % len(paths)]
+                step += 1
+                start = time.perf_counter()
+                try:
+                    connection.request(
+                        'GET', path, headers={**self.host(), **headers},
+                    )
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    errors.append(path)
+                    continue
+                timings.append((time.perf_counter() - start) * 1000)
+                if response.status != 200:
+                    errors.append(path)
+            connection.close()
+
+        threads = [
+            threading.Thread(target=client, args=(offset,))
+            for offset in range(concurrency)
+        ]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        timings.sort()
+        if not timings:
+            raise CommandError('Сервер не ответил ни на один запрос')
+        return {
+            'requests': len(timings),
+            'errors': len(errors),
+            'rps': round(len(timings) / elapsed, 1),
+            'p50_ms': round(timings[len(timings) // 2], 2),
+            'p95_ms': round(timings[int(len(timings) * 0.95)], 2),
+        }
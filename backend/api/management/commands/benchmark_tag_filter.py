@@ -0,0 +1,106 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+from recipes.models import Recipe, Tag
+from users.models import User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    '''Сравнивает варианты фильтра рецептов по всем выбранным тегам.
+    joins — прежний фильтр с join на каждый тег, having — группировка
+    с HAVING COUNT, exists — подзапрос EXISTS на каждый тег,
+    как в RecipeFilter.
+    Синтетические рецепты создаются в транзакции, которая в конце
+    откатывается.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100_000)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument('--selected', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                tags = self.seed(options['recipes'], options['tags'])
+                slugs = [tag.slug for tag in tags[:options['selected']]]
+                for name, build in (('joins', self.old_filter),
+                                    ('having', self.new_filter),
+                                    ('exists', self.exists_filter)):
+                    self.measure(name, build, slugs, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, recipes_count, tags_count):
+        author = User.objects.create(
+            username='benchmark', email='benchmark@example.com',
+        )
+        tags = Tag.objects.bulk_create([
+            Tag(name=f'benchmark {i}', slug=f'benchmark-{i}',
+                color=f'#b{i:05x}')
+            for i in range(tags_count)
+        ])
+        recipes = Recipe.objects.bulk_create([
+            Recipe(author=author, name=f'benchmark {i}', text='',
+                   cooking_time=1, image='recipes/images/temp.png')
+            for i in range(recipes_count)
+        ], batch_size=5000)
+        through = Recipe.tags.through
+        through.objects.bulk_create([
+            through(recipe_id=recipe.pk, tag_id=tag.pk)
+            for recipe in recipes
+            for tag in random.sample(tags, random.randint(1, len(tags)))
+        ], batch_size=5000)
+        return tags
+
+    def old_filter(self, slugs):
+        queryset = Recipe.objects.all()
+        for slug in slugs:
+            queryset = queryset.filter(tags__slug=slug)
+        return queryset
+
+    def new_filter(self, slugs):
+        tag_ids = set(Tag.objects.filter(slug__in=slugs).values_list(
+            'pk', flat=True,
+        ))
+        recipes = Recipe.tags.through.objects.filter(
+            tag_id__in=tag_ids,
+        ).values('recipe_id').annotate(
+            tags_count=Count('tag_id'),
+        ).filter(tags_count=len(tag_ids)).values('recipe_id')
+        return Recipe.objects.filter(pk__in=recipes)
+
+    def exists_filter(self, slugs):
+        queryset = Recipe.objects.all()
+        through = Recipe.tags.through
+        for tag_id in Tag.objects.filter(slug__in=slugs).values_list(
+            'pk', flat=True,
+        ):
+            queryset = queryset.filter(Exists(through.objects.filter(
+                recipe_id=OuterRef('pk'), tag_id=tag_id,
+            )))
+        return queryset
+
+    def measure(self, name, build, slugs, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            queryset = build(slugs)
+            count = queryset.count()
+            list(queryset.values_list('pk', flat=True)[:6])
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        self.stdout.write(
+            f'{name}: {count} рецептов, '
+            f'медиана {timings[len(timings) // 2] * 1000:.1f} мс, '
+            f'максимум {timings[-1] * 1000:.1f} мс'
+        )
@@ -0,0 +1,16 @@
+from api.images import make_variants, missing_variants
+from django.core.management.base import BaseCommand
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    '''Создаёт недостающие варианты изображений всех рецептов.'''
+
+    def handle(self, *args, **options):
+        count = 0
+        for recipe in Recipe.objects.only('pk', 'image').iterator():
+            if recipe.image and missing_variants(recipe.image):
+                make_variants(recipe.image.storage, recipe.image.name,
+                              recipe.pk)
+                count += 1
+        print(f'Созданы варианты изображений {count} рецептов')
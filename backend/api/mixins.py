@@ -0,0 +1,72 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.utils.http import parse_etags, urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cache import CACHE_TIMEOUT, cache_timeout, get_version
+
+
+def response_cache_key(model, action, lookup, params):
+    '''Ключ кэша ответа из версии данных модели, действия и параметров.'''
+    params = urlencode(sorted(params.lists()), doseq=True)
+    return ':'.join((
+        'response',
+        model._meta.label_lower,
+        str(get_version(model)),
+        action,
+        str(lookup),
+        hashlib.md5(params.encode()).hexdigest(),
+    ))
+
+
+def response_etag(media_type, data):
+    content = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    content = f'{media_type}\n{content}'
+    return '"{}"'.format(hashlib.sha256(content.encode()).hexdigest())
+
+
+class CachedResponseMixin:
+    '''Кэширует ответы list и retrieve и отдаёт их с ETag.
+    Ключ кэша строится из версии данных модели, действия и query параметров,
+    поэтому изменение модели сразу делает кэш неактуальным.
+    '''
+    cache_timeout = CACHE_TIMEOUT
+
+    def get_cache_key(self, request):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return response_cache_key(
+            self.get_queryset().model,
+            self.action,
+            self.kwargs.get(lookup_url_kwarg, ''),
+            request.query_params,
+        )
+
+    def get_etag(self, request, data):
+        return response_etag(request.accepted_media_type, data)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        cache_key = self.get_cache_key(request)
+        data = cache.get(cache_key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            cache.set(cache_key, data, cache_timeout(self.cache_timeout))
+        etag = self.get_etag(request, data)
+        headers = {'ETag': etag}
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers=headers)
+        return Response(data, headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
@@ -1,6 +1,64 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+RECIPES_LIMIT = 3
+MAX_RECIPES_LIMIT = 100
+MAX_PAGE_SIZE = 100
 
 
 class LimitPageNumberPagination(PageNumberPagination):
     '''Переопредлеяет название query параметра'''
     page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+
+
+class LimitCursorPagination(CursorPagination):
+    '''Курсорная пагинация с query параметром limit.
+    Сортировка берётся из запроса или из Meta.ordering модели.
+    '''
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(queryset.query.order_by or queryset.model._meta.ordering)
+
+
+class FeedPagination(LimitPageNumberPagination):
+    '''Постраничная пагинация с переключением на курсорную.
+    Курсорная пагинация включается query параметром cursor, для первой
+    страницы он передаётся пустым. Общее количество объектов в этом режиме
+    можно не считать, передав count=false.
+    '''
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_pagination = None
+        if self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor_pagination = LimitCursorPagination()
+        self.count = None
+        if request.query_params.get(self.count_query_param) != 'false':
+            self.count = queryset.count()
+        return self.cursor_pagination.paginate_queryset(
+            queryset, request, view,
+        )
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is None:
+            return super().get_paginated_response(data)
+        response = self.cursor_pagination.get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+            response.data.move_to_end('count', last=False)
+        return response
+
+
+def get_recipes_limit(request):
+    '''Количество рецептов автора в выдаче подписок.
+    Берётся из query параметра recipes_limit и ограничивается сверху.
+    '''
+    try:
+        limit = int(request.query_params['recipes_limit'])
+    except (KeyError, ValueError):
+        return RECIPES_LIMIT
+    return min(max(limit, 0), MAX_RECIPES_LIMIT)
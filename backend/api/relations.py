@@ -0,0 +1,149 @@
+from django.db import connections, router, transaction
+from django.db.models.sql import DeleteQuery
+from recipes.models import Favorite, ShoppingCart
+from recipes.signals import change_favorites_count, change_shopping_lists
+from users.models import Follow
+from users.signals import change_followers_count
+
+from .cache import invalidate_user_relation
+
+
+def insert_ignore(model, objs):
+    '''Вставляет objs одним INSERT ... ON CONFLICT DO NOTHING.
+    Возвращает добавленные строки объектами без pk, уже существующие
+    пропускаются. RETURNING есть в PostgreSQL и SQLite 3.35+.
+    '''
+    connection = connections[router.db_for_write(model)]
+    quote_name = connection.ops.quote_name
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+    columns = ', '.join(quote_name(field.column) for field in fields)
+    row = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    sql = (
+        f'INSERT INTO {quote_name(model._meta.db_table)} ({columns}) '
+        f'VALUES {", ".join([row] * len(objs))} '
+        f'ON CONFLICT DO NOTHING RETURNING {columns}'
+    )
+    params = [
+        field.get_db_prep_save(getattr(obj, field.attname), connection)
+        for obj in objs for field in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    names = [field.attname for field in fields]
+    return [model(**dict(zip(names, values))) for values in rows]
+
+
+def delete_returning(queryset):
+    '''Удаляет строки queryset одним DELETE ... RETURNING без
+    выборки объектов и сигналов. Возвращает удалённые строки
+    объектами без pk.
+    '''
+    model = queryset.model
+    using = router.db_for_write(model)
+    connection = connections[using]
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+    sql, params = queryset.query.chain(DeleteQuery).get_compiler(
+        using,
+    ).as_sql()
+    sql += ' RETURNING ' + ', '.join(
+        connection.ops.quote_name(field.column) for field in fields
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    names = [field.attname for field in fields]
+    return [model(**dict(zip(names, values))) for values in rows]
+
+
+def add_relation(model, **fields):
+    '''Добавляет связь. Возвращает False, если такая связь уже есть.'''
+    with transaction.atomic():
+        created = insert_ignore(model, [model(**fields)])
+        relations_changed(model, created, 1)
+    return bool(created)
+
+
+def remove_relation(model, **fields):
+    '''Удаляет связь. Возвращает False, если связи не было.'''
+    with transaction.atomic():
+        deleted = delete_returning(model.objects.filter(**fields))
+        relations_changed(model, deleted, -1)
+    return bool(deleted)
+
+
+def add_relations(model, field, values, **fields):
+    '''Добавляет связи со всеми values одним INSERT.
+    Возвращает множество значений field, для которых связь добавлена.
+    '''
+    if not values:
+        return set()
+    attname = model._meta.get_field(field).attname
+    with transaction.atomic():
+        created = insert_ignore(model, [
+            model(**{attname: value}, **fields) for value in values
+        ])
+        relations_changed(model, created, 1)
+    return {getattr(instance, attname) for instance in created}
+
+
+def remove_relations(model, field, values, **fields):
+    '''Удаляет связи со всеми values одним DELETE. Возвращает
+    множество значений field у удалённых строк.
+    '''
+    if not values:
+        return set()
+    attname = model._meta.get_field(field).attname
+    with transaction.atomic():
+        deleted = delete_returning(model.objects.filter(
+            **{f'{field}__in': values}, **fields,
+        ))
+        relations_changed(model, deleted, -1)
+    return {getattr(instance, attname) for instance in deleted}
+
+
+def relations_changed(model, instances, sign):
+    '''Делает для добавленных (sign=1) или удалённых (sign=-1) связей
+    то же, что обработчики post_save и post_delete для одиночных:
+    вставка и удаление здесь идут мимо сигналов. Счётчики меняются
+    одним UPDATE на модель, список покупок — одним на пользователя.
+    '''
+    if not instances:
+        return
+    if model is Favorite:
+        change_favorites_count(
+            [instance.recipe_id for instance in instances], sign,
+        )
+    elif model is ShoppingCart:
+        change_shopping_lists(instances, sign)
+    elif model is Follow:
+        change_followers_count(
+            [instance.author_id for instance in instances], sign,
+        )
+    for user_id in {instance.user_id for instance in instances}:
+        invalidate_user_relation(user_id, model)
+
+
+def batch_results(ids, found, changed, status_code, error, rejected=None):
+    '''Результат пакетной операции для каждого id.
+    Коды и сообщения совпадают с ответами одиночных запросов.
+    '''
+    rejected = rejected or {}
+    results = []
+    for pk in ids:
+        if pk in rejected:
+            result = {'status': 400, 'errors': rejected[pk]}
+        elif pk not in found:
+            result = {'status': 404, 'errors': 'not found'}
+        elif pk in changed:
+            result = {'status': status_code}
+        else:
+            result = {'status': 400, 'errors': error}
+        results.append({'id': pk, **result})
+    return results
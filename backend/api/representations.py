@@ -0,0 +1,74 @@
+from collections import defaultdict
+
+from recipes.models import IngredientAmount, Recipe, Tag
+from users.models import User
+
+from .fields import image_variants
+
+AUTHOR_FIELDS = ('email', 'id', 'username', 'first_name', 'last_name')
+TAG_FIELDS = ('id', 'name', 'color', 'slug')
+INGREDIENT_FIELDS = {
+    'id': 'ingredients_id',
+    'name': 'ingredients__name',
+    'measurement_unit': 'ingredients__measurement_unit',
+    'amount': 'amount',
+}
+
+
+def recipes_representation(pks, request):
+    '''Представления рецептов для чтения, совпадающие с выводом
+    RecipeSerializer. Строятся из строк .values() без создания моделей
+    и сериализаторов полей. Запросы те же, что при prefetch_related,
+    поэтому порядок тегов и ингредиентов не меняется. Флаги избранного,
+    корзины и подписки заполняются False, их проставляет вызывающий код.
+    '''
+    recipes = list(Recipe.objects.filter(pk__in=pks).values(
+        'id', 'name', 'author_id', 'text', 'cooking_time', 'image',
+    ))
+    if not recipes:
+        return []
+    recipe_ids = [recipe['id'] for recipe in recipes]
+    authors = {
+        author['id']: author
+        for author in User.objects.filter(
+            pk__in={recipe['author_id'] for recipe in recipes},
+        ).values(*AUTHOR_FIELDS)
+    }
+    tags = defaultdict(list)
+    for tag in Tag.objects.filter(recipes__in=recipe_ids).values(
+        *TAG_FIELDS, 'recipes',
+    ):
+        tags[tag.pop('recipes')].append(tag)
+    ingredients = defaultdict(list)
+    for amount in IngredientAmount.objects.filter(
+        recipe__in=recipe_ids,
+    ).values('recipe_id', *INGREDIENT_FIELDS.values()):
+        ingredients[amount['recipe_id']].append({
+            field: amount[column]
+            for field, column in INGREDIENT_FIELDS.items()
+        })
+    storage = Recipe._meta.get_field('image').storage
+    data = []
+    for recipe in recipes:
+        image = None
+        variants = None
+        if recipe['image']:
+            url = storage.url(recipe['image'])
+            image = request.build_absolute_uri(url)
+            variants = image_variants(recipe['image'], url, request)
+        data.append({
+            'id': recipe['id'],
+            'name': recipe['name'],
+            'tags': tags[recipe['id']],
+            'author': {
+                **authors[recipe['author_id']], 'is_subscribed': False,
+            },
+            'ingredients': ingredients[recipe['id']],
+            'is_favorited': False,
+            'is_in_shopping_cart': False,
+            'text': recipe['text'],
+            'cooking_time': recipe['cooking_time'],
+            'image': image,
+            'image_variants': variants,
+        })
+    return data
@@ -1,15 +1,20 @@
 from collections import OrderedDict
 
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from recipes.models import (Ingredient, IngredientAmount, Recipe, ShoppingCart,
-                            Tag)
+                            ShoppingListItem, Tag)
 from rest_framework import serializers
 from users.models import Follow
 
-from .fields import Base64ImageField
+from .cache import invalidate_recipes
+from .fields import Base64ImageField, ImageVariantsField
+from .pagination import get_recipes_limit
 
 User = get_user_model()
 
+BATCH_LIMIT = 100
+
 
 class IngredientSerializer(serializers.ModelSerializer):
     '''Сериализатор ингредиентов.'''
@@ -32,6 +37,8 @@ class UserSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         '''Поле для отображения подписки на пользователя.'''
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         if user.is_authenticated:
             return Follow.objects.filter(
@@ -96,6 +103,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     ingredients = IngredientAmountSerializer(many=True)
     image = Base64ImageField(required=True, allow_null=True)
+    image_variants = ImageVariantsField(source='image')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     tags = TagField(queryset=Tag.objects.all(), many=True)
@@ -105,9 +113,17 @@ class RecipeSerializer(serializers.ModelSerializer):
         fields = (
             'id', 'name', 'tags', 'author', 'ingredients',
             'is_favorited', 'is_in_shopping_cart',
-            'text', 'cooking_time', 'image',
+            'text', 'cooking_time', 'image', 'image_variants',
         )
 
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if hasattr(image, 'close'):
+                image.close()
+
     def validate_tags(self, tags):
         if not tags:
             raise serializers.ValidationError('At least one tag required')
@@ -129,13 +145,17 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     def get_is_favorited(self, obj):
         '''Отображает, что рецепт в избранном.'''
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         if user.is_authenticated:
-            return obj in user.favorite.all()
+            return user.favorite.filter(recipe=obj).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
         '''Отображает, что рецепт в корзине.'''
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         if user.is_authenticated:
             return ShoppingCart.objects.filter(recipe=obj, user=user).exists()
@@ -149,6 +169,7 @@ class RecipeSerializer(serializers.ModelSerializer):
         ) for ingredient in ingredients]
         IngredientAmount.objects.bulk_create(ingredients_amount)
 
+    @transaction.atomic
     def create(self, validated_data):
         user = self.context.get('request').user
         ingredients = validated_data.pop('ingredients')
@@ -158,35 +179,86 @@ class RecipeSerializer(serializers.ModelSerializer):
         recipe.tags.set(tags)
         return recipe
 
+    def ingredients_update(self, recipe, ingredients):
+        '''Обновляет только изменившиеся ингредиенты рецепта.'''
+        existing = {
+            amount.ingredients_id: amount
+            for amount in recipe.ingredients.all()
+        }
+        changed, created, deltas = [], [], {}
+        for ingredient in ingredients:
+            pk = ingredient['ingredients']['pk'].pk
+            amount = int(ingredient['amount'])
+            current = existing.pop(pk, None)
+            if current is None:
+                created.append(IngredientAmount(
+                    recipe=recipe, ingredients_id=pk, amount=amount,
+                ))
+                deltas[pk] = amount
+            elif current.amount != amount:
+                deltas[pk] = amount - current.amount
+                current.amount = amount
+                changed.append(current)
+        # Удалённые ингредиенты вычитает из списков покупок
+        # обработчик post_delete.
+        if existing:
+            IngredientAmount.objects.filter(
+                pk__in=[amount.pk for amount in existing.values()],
+            ).delete()
+        if changed:
+            IngredientAmount.objects.bulk_update(changed, ['amount'])
+        if created:
+            IngredientAmount.objects.bulk_create(created)
+        if deltas:
+            ShoppingListItem.objects.add_amounts(
+                list(recipe.shopping_cart.values_list('user_id', flat=True)),
+                deltas,
+            )
+
+    def tags_update(self, recipe, tags):
+        '''Удаляет снятые теги и добавляет новые.'''
+        current = {tag.pk for tag in recipe.tags.all()}
+        selected = {tag.pk for tag in tags}
+        if removed := current - selected:
+            recipe.tags.remove(*removed)
+        if added := selected - current:
+            recipe.tags.add(*added)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        if ingredients := validated_data.get('ingredients'):
-            IngredientAmount.objects.filter(recipe=instance).delete()
-            self.ingredients_create(instance, ingredients)
-        if tags := validated_data.get('tags'):  # ЛОВИ МОРЖЕЙ!!!!!1
-            instance.tags.set(tags)
-        instance.image = validated_data.get('image', instance.image)
-        instance.name = validated_data.get('name', instance.name)
-        instance.cooking_time = validated_data.get(
-            'cooking_time',
-            instance.cooking_time,
-        )
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if ingredients is not None:
+            self.ingredients_update(instance, ingredients)
+        if tags is not None:
+            self.tags_update(instance, tags)
+        update_fields = []
+        for field, value in validated_data.items():
+            if getattr(instance, field) != value:
+                setattr(instance, field, value)
+                update_fields.append(field)
+        if update_fields:
+            instance.save(update_fields=update_fields)
+        invalidate_recipes(instance.pk)
         return instance
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
     '''Сериализатор избранного.'''
+    image_variants = ImageVariantsField(source='image')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'cooking_time', 'image')
+        fields = ('id', 'name', 'cooking_time', 'image', 'image_variants')
 
 
 class SubscriptionRecipeSerializer(serializers.ModelSerializer):
     '''Сериализатор рецептов для сериализатора подписок.'''
+    image_variants = ImageVariantsField(source='image')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class SubscriptionSerializer(UserSerializer):
@@ -203,21 +275,18 @@ class SubscriptionSerializer(UserSerializer):
 
     def get_recipes(self, obj):
         '''Получает объекты для поля recipes'''
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit:
-            queryset = Recipe.objects.filter(
-                author=obj)[:int(recipes_limit)]
+        if hasattr(obj, 'latest_recipes'):
+            queryset = obj.latest_recipes
         else:
-            queryset = obj.recipes
+            request = self.context.get('request')
+            queryset = obj.recipes.all()[:get_recipes_limit(request)]
         serializer = SubscriptionRecipeSerializer(
             instance=queryset, many=True,
         )
         return serializer.data
 
     def get_recipes_count(self, obj):
-        count = Recipe.objects.filter(author=obj).count()
-        return count
+        return obj.recipes_count
 
 
 class ShoppingCartSerializer(RecipeSerializer):
@@ -225,4 +294,29 @@ class ShoppingCartSerializer(RecipeSerializer):
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+
+class BatchSerializer(serializers.Serializer):
+    '''Сериализатор списка id для пакетных операций.'''
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_LIMIT,
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
+
+class ShoppingListSerializer(serializers.ModelSerializer):
+    '''Сериализатор сводного списка покупок.'''
+    id = serializers.ReadOnlyField(source='ingredient_id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
@@ -0,0 +1,85 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from recipes.models import (Favorite, Ingredient, IngredientAmount, Recipe,
+                            ShoppingCart, Tag)
+from rest_framework.authtoken.models import Token
+from users.models import Follow, User
+
+from .authentication import token_cache
+from .cache import bump_version, invalidate_recipes, invalidate_user_relation
+from .images import schedule_variants
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def catalog_changed(sender, **kwargs):
+    '''Сбрасывает кэш ответов при изменении ингредиентов или тегов.'''
+    bump_version(sender)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    '''Сбрасывает кэш представления рецепта.'''
+    invalidate_recipes(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, raw, **kwargs):
+    '''Запускает создание вариантов изображения рецепта после коммита.'''
+    if not raw:
+        transaction.on_commit(lambda: schedule_variants(instance))
+
+
+@receiver(post_save, sender=IngredientAmount)
+@receiver(post_delete, sender=IngredientAmount)
+def recipe_ingredients_changed(sender, instance, **kwargs):
+    '''Сбрасывает кэш рецепта при изменении его ингредиентов.'''
+    invalidate_recipes(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    '''Сбрасывает кэш рецептов при изменении их тегов.'''
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_recipes(instance.pk)
+    elif pk_set:
+        invalidate_recipes(*pk_set)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    '''Сбрасывает кэш рецептов автора при изменении его данных.'''
+    if created or update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_recipes(*instance.recipes.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def user_relation_changed(sender, instance, **kwargs):
+    '''Сбрасывает кэш избранного, корзины или подписок пользователя.'''
+    invalidate_user_relation(instance.user_id, sender)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    '''Сбрасывает кэш аутентификации при выходе пользователя.'''
+    token_cache.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    '''Сбрасывает кэш аутентификации при смене пароля, деактивации
+    и любом другом изменении пользователя.
+    '''
+    token_cache.invalidate(instance.pk)
@@ -0,0 +1,1068 @@
+import base64
+import itertools
+import os
+import re
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import Sum
+from django.http import QueryDict
+from django.test import (AsyncClient, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from foodgram import replicas
+from foodgram.metrics import QueryBudgetExceeded, registry
+from recipes.models import (Favorite, Ingredient, IngredientAmount, Recipe,
+                            ShoppingCart, Tag)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from users.models import Follow, User
+
+from api import async_views
+from api.authentication import TokenCache
+from api.cache import (get_recipe_versions, get_version, recipe_version_key,
+                       version_key)
+from api.fields import Base64ImageField, image_variants
+from api.filters import IngredientFilter, RecipeFilter
+from api.pagination import (MAX_PAGE_SIZE, LimitCursorPagination,
+                            LimitPageNumberPagination)
+from api.serializers import RecipeSerializer
+from api.views import get_recipes_data
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+# Маршруты с асинхронными представлениями для AsyncViewsTest,
+# как при ASYNC_API.
+urlpatterns = [
+    path('api/recipes/', async_views.recipe_list),
+    path('api/recipes/<int:pk>/', async_views.recipe_detail),
+    path('api/ingredients/', async_views.ingredient_list),
+    path('api/tags/', async_views.tag_list),
+    path('api/', include('api.urls')),
+]
+
+
+@override_settings(
+    ALLOWED_HOSTS=['testserver'],
+    MEDIA_ROOT=MEDIA_ROOT,
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    },
+)
+class APITestCase(TestCase):
+    '''Общие данные для тестов API: автор и подписанный на него
+    пользователь, у которого рецепты автора в избранном и в корзине.
+    '''
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.user = cls.create_user('user')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}',
+            )
+            for number in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г',
+            )
+            for number in range(3)
+        ]
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    @classmethod
+    def create_user(cls, name):
+        return User.objects.create_user(
+            username=name, email=f'{name}@example.com', password='pass',
+            first_name=name, last_name=name,
+        )
+
+    def setUp(self):
+        # Изображений рецептов в тестах нет, варианты не создаются.
+        patcher = mock.patch('api.signals.schedule_variants')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.client = APIClient()
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def create_recipes(self, count, author=None):
+        recipes = []
+        for _ in range(count):
+            recipe = Recipe.objects.create(
+                author=author or self.author, name='Рецепт', text='Текст',
+                cooking_time=10, image='recipes/images/test.png',
+            )
+            recipe.tags.set(self.tags)
+            IngredientAmount.objects.bulk_create(
+                IngredientAmount(recipe=recipe, ingredients=ingredient,
+                                 amount=10)
+                for ingredient in self.ingredients
+            )
+            Favorite.objects.create(user=self.user, recipe=recipe)
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+            recipes.append(recipe)
+        return recipes
+
+    def get(self, url):
+        '''GET с пустыми кэшами ответов и аутентификации: без версий
+        в общем кэше записи token_cache недействительны.
+        '''
+        cache.clear()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+
+class RecipeQueriesTest(APITestCase):
+    '''Число запросов к БД не зависит от числа рецептов.'''
+
+    def test_recipe_list(self):
+        self.create_recipes(2)
+        with self.assertNumQueries(10):
+            self.get('/api/recipes/')
+        self.create_recipes(4)
+        with self.assertNumQueries(10):
+            data = self.get('/api/recipes/')
+        self.assertEqual(len(data['results']), 6)
+        for recipe in data['results']:
+            self.assertTrue(recipe['is_favorited'])
+            self.assertTrue(recipe['is_in_shopping_cart'])
+            self.assertTrue(recipe['author']['is_subscribed'])
+
+    def test_serializer_is_favorited(self):
+        recipe, other = self.create_recipes(2)
+        Favorite.objects.filter(recipe=other).delete()
+        request = RequestFactory().get('/')
+        request.user = self.user
+        serializer = RecipeSerializer(context={'request': request})
+        with self.assertNumQueries(2):
+            self.assertTrue(serializer.get_is_favorited(recipe))
+            self.assertFalse(serializer.get_is_favorited(other))
+
+    def test_recipe_detail(self):
+        recipe = self.create_recipes(1)[0]
+        with self.assertNumQueries(9):
+            data = self.get(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(len(data['tags']), 2)
+        self.assertEqual(len(data['ingredients']), 3)
+        self.assertTrue(data['is_favorited'])
+
+    def test_favorite_and_shopping_cart(self):
+        recipe = self.create_recipes(1)[0]
+        Favorite.objects.all().delete()
+        ShoppingCart.objects.all().delete()
+        cache.clear()
+        with self.assertNumQueries(6):
+            response = self.client.post(f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 201)
+        with self.assertNumQueries(10):
+            response = self.client.post(
+                f'/api/recipes/{recipe.pk}/shopping_cart/',
+            )
+        self.assertEqual(response.status_code, 201)
+        with self.assertNumQueries(5):
+            response = self.client.delete(
+                f'/api/recipes/{recipe.pk}/favorite/',
+            )
+        self.assertEqual(response.status_code, 204)
+        with self.assertNumQueries(10):
+            response = self.client.delete(
+                f'/api/recipes/{recipe.pk}/shopping_cart/',
+            )
+        self.assertEqual(response.status_code, 204)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertFalse(self.user.shopping_list.exists())
+
+
+class RepresentationTest(APITestCase):
+    '''Представления рецептов без сериализаторов совпадают
+    с выводом RecipeSerializer.
+    '''
+
+    def request(self, user):
+        request = Request(RequestFactory().get('/api/recipes/'))
+        request.user = user
+        return request
+
+    def test_same_as_serializer(self):
+        recipes = self.create_recipes(2)
+        # Рецепт без флагов: свой, не в избранном и не в корзине.
+        recipes += self.create_recipes(1, author=self.user)
+        Favorite.objects.filter(recipe=recipes[-1]).delete()
+        ShoppingCart.objects.filter(recipe=recipes[-1]).delete()
+        pks = [recipe.pk for recipe in recipes]
+        for user in (AnonymousUser(), self.user):
+            request = self.request(user)
+            expected = RecipeSerializer(
+                Recipe.objects.with_related_for_api(user).filter(
+                    pk__in=pks,
+                ).order_by('pk'),
+                many=True,
+                context={'request': request},
+            ).data
+            cache.clear()
+            data = get_recipes_data(request, pks)
+            with self.subTest(user=user):
+                self.assertEqual(
+                    JSONRenderer().render(data),
+                    JSONRenderer().render(expected),
+                )
+                flags = [
+                    (item['is_favorited'], item['is_in_shopping_cart'],
+                     item['author']['is_subscribed'])
+                    for item in data
+                ]
+                authorized = user.is_authenticated
+                self.assertEqual(flags, [(authorized,) * 3] * 2 + [
+                    (False, False, False),
+                ])
+                self.assertEqual(
+                    data[0]['image'],
+                    'http://testserver/media/recipes/images/test.png',
+                )
+
+
+class PaginationTest(APITestCase):
+    '''Постраничная и курсорная пагинация ленты рецептов.'''
+
+    def setUp(self):
+        super().setUp()
+        self.pks = [recipe.pk for recipe in reversed(self.create_recipes(5))]
+
+    def test_page_number(self):
+        data = self.get('/api/recipes/?page=2&limit=2')
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(
+            [recipe['id'] for recipe in data['results']], self.pks[2:4],
+        )
+        self.assertIn('page=3', data['next'])
+        self.assertIn('limit=2', data['next'])
+        self.assertIn('limit=2', data['previous'])
+        self.assertNotIn('cursor', data['next'])
+
+    def test_cursor(self):
+        url = 'http://testserver/api/recipes/?cursor=&limit=2'
+        pks = []
+        while url:
+            data = self.get(url)
+            self.assertEqual(data['count'], 5)
+            self.assertLessEqual(len(data['results']), 2)
+            pks += [recipe['id'] for recipe in data['results']]
+            url = data['next']
+        self.assertEqual(pks, self.pks)
+        data = self.get(data['previous'])
+        self.assertEqual(
+            [recipe['id'] for recipe in data['results']], self.pks[2:4],
+        )
+
+    def test_cursor_without_count(self):
+        data = self.get('/api/recipes/?cursor=&limit=2&count=false')
+        self.assertNotIn('count', data)
+        self.assertEqual(
+            [recipe['id'] for recipe in data['results']], self.pks[:2],
+        )
+
+    def test_limit_cap(self):
+        for pagination in (LimitPageNumberPagination, LimitCursorPagination):
+            self.assertEqual(pagination.max_page_size, MAX_PAGE_SIZE)
+        with mock.patch.object(LimitPageNumberPagination, 'max_page_size',
+                               3), \
+                mock.patch.object(LimitCursorPagination, 'max_page_size', 3):
+            for url in ('/api/recipes/?limit=1000',
+                        '/api/recipes/?cursor=&limit=1000'):
+                with self.subTest(url=url):
+                    self.assertEqual(len(self.get(url)['results']), 3)
+
+
+class CachedResponseTest(APITestCase):
+    '''Кэшированные ответы тегов и ингредиентов с ETag.'''
+
+    def test_not_modified(self):
+        response = self.client.get('/api/tags/')
+        etag = response['ETag']
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH='"x"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_changes_after_write(self):
+        for url, create in (
+            ('/api/tags/', lambda: Tag.objects.create(
+                name='Новый', color='#ffffff', slug='new',
+            )),
+            ('/api/ingredients/', lambda: Ingredient.objects.create(
+                name='Новый', measurement_unit='г',
+            )),
+        ):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.captureOnCommitCallbacks(execute=True):
+                    create()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+                self.assertIn('Новый', [
+                    item['name'] for item in response.json()
+                ])
+
+
+class RelationTest(APITestCase):
+    '''Избранное, корзина и подписки вместе со счётчиками и списком
+    покупок.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipes(1)[0]
+        Favorite.objects.all().delete()
+        ShoppingCart.objects.all().delete()
+        Follow.objects.all().delete()
+
+    def shopping_list(self):
+        return dict(self.user.shopping_list.values_list(
+            'ingredient_id', 'amount',
+        ))
+
+    def test_favorite(self):
+        url = f'/api/recipes/{self.recipe.pk}/favorite/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+    def test_shopping_cart(self):
+        url = f'/api/recipes/{self.recipe.pk}/shopping_cart/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.shopping_list(), {
+            ingredient.pk: 10 for ingredient in self.ingredients
+        })
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(self.shopping_list(), {})
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+
+    def batch(self, method, url, ids):
+        response = getattr(self.client, method)(
+            url, {'ids': ids}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return [result['status'] for result in response.json()]
+
+    def test_batch(self):
+        other = self.create_recipes(1)[0]
+        Favorite.objects.all().delete()
+        ShoppingCart.objects.all().delete()
+        ids = [self.recipe.pk, other.pk, 999]
+        self.client.post(f'/api/recipes/{self.recipe.pk}/favorite/')
+        url = '/api/recipes/favorite/batch/'
+        self.assertEqual(self.batch('post', url, ids), [400, 201, 404])
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('favorites_count', flat=True)),
+            [1, 1],
+        )
+        self.assertEqual(self.batch('delete', url, ids), [204, 204, 404])
+        self.assertFalse(Recipe.objects.filter(favorites_count__gt=0))
+        url = '/api/recipes/shopping_cart/batch/'
+        self.assertEqual(self.batch('post', url, ids), [201, 201, 404])
+        self.assertEqual(self.shopping_list(), {
+            ingredient.pk: 20 for ingredient in self.ingredients
+        })
+        self.assertEqual(self.batch('delete', url, ids[:1]), [204])
+        self.assertEqual(self.shopping_list(), {
+            ingredient.pk: 10 for ingredient in self.ingredients
+        })
+        url = '/api/users/subscribe/batch/'
+        self.assertEqual(self.batch('post', url, [self.author.pk]), [201])
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+
+    def test_batch_queries(self):
+        '''Число запросов пакетной операции не зависит от числа id.'''
+        ids = [recipe.pk for recipe in self.create_recipes(3)]
+        Favorite.objects.all().delete()
+        ShoppingCart.objects.all().delete()
+        # Токен попадает в кэш аутентификации при первом запросе.
+        self.client.get('/api/users/me/')
+        for name in ('favorite', 'shopping_cart'):
+            url = f'/api/recipes/{name}/batch/'
+            for method in ('post', 'delete'):
+                queries = []
+                for batch in (ids[:1], ids[1:]):
+                    with CaptureQueriesContext(connection) as context:
+                        self.batch(method, url, batch)
+                    queries.append(len(context))
+                with self.subTest(name=name, method=method):
+                    self.assertEqual(queries[0], queries[1])
+        self.assertFalse(Recipe.objects.filter(favorites_count__gt=0))
+        self.assertEqual(self.shopping_list(), {})
+
+
+class ShoppingListTest(APITestCase):
+    '''Сводный список покупок совпадает с суммой по корзине после
+    изменения ингредиентов рецепта.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.recipe, self.other = self.create_recipes(2)
+
+    def assertShoppingListFresh(self):
+        expected = dict(IngredientAmount.objects.filter(
+            recipe__shopping_cart__user=self.user,
+        ).values('ingredients').annotate(
+            total=Sum('amount'),
+        ).values_list('ingredients', 'total').order_by())
+        self.assertEqual(dict(self.user.shopping_list.values_list(
+            'ingredient_id', 'amount',
+        )), expected)
+
+    def test_admin_inline_edit(self):
+        '''Инлайн админки сохраняет и удаляет строки по одной.'''
+        first, second, third = self.recipe.ingredients.order_by('pk')
+        first.amount = 25
+        first.save()
+        second.ingredients = self.ingredients[0]
+        second.delete()
+        third.ingredients = self.ingredients[1]
+        third.save()
+        IngredientAmount.objects.create(
+            recipe=self.recipe, ingredients=self.ingredients[2], amount=7,
+        )
+        self.assertShoppingListFresh()
+
+    def test_recipe_update(self):
+        client = APIClient()
+        token = Token.objects.create(user=self.author)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = client.patch(f'/api/recipes/{self.recipe.pk}/', {
+            'ingredients': [
+                {'id': self.ingredients[0].pk, 'amount': 30},
+                {'id': self.ingredients[1].pk, 'amount': 10},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertShoppingListFresh()
+
+    def test_recipe_deleted(self):
+        self.recipe.delete()
+        self.assertShoppingListFresh()
+
+
+class TokenCacheTest(APITestCase):
+    '''Отозванный токен перестаёт работать сразу во всех воркерах.'''
+
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.get(user=self.user)
+        # Кэш токенов другого процесса: сигналы этого процесса
+        # до него не доходят, только версия в общем кэше.
+        self.worker = TokenCache(maxsize=10, ttl=60)
+        self.worker.set(self.token.key, self.user, self.token)
+
+    def test_cached(self):
+        with self.assertNumQueries(0):
+            user, token = self.worker.get(self.token.key)
+        self.assertEqual(user, self.user)
+
+    def test_logout(self):
+        self.get('/api/users/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(self.worker.get(self.token.key))
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_user_deactivated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertIsNone(self.worker.get(self.token.key))
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_invalidate(self):
+        '''Записи пользователя удаляются по индексу, вытеснение
+        и повторная запись индекс не портят.
+        '''
+        token = Token.objects.create(user=self.author)
+        worker = TokenCache(maxsize=2, ttl=60)
+        worker.set('old', self.user, self.token)
+        worker.set(self.token.key, self.user, self.token)
+        worker.set(token.key, self.author, token)
+        self.assertEqual(list(worker.entries), [self.token.key, token.key])
+        self.assertEqual(worker.user_keys, {
+            self.user.pk: {self.token.key}, self.author.pk: {token.key},
+        })
+        worker.set(self.token.key, self.user, self.token)
+        worker.invalidate(self.user.pk)
+        self.assertEqual(list(worker.entries), [token.key])
+        self.assertEqual(worker.user_keys, {self.author.pk: {token.key}})
+        self.assertIsNotNone(worker.get(token.key))
+
+
+class RecipeFilterTest(APITestCase):
+    '''Фильтр рецептов по тегам.'''
+
+    def test_tags(self):
+        tagged, untagged = self.create_recipes(2)
+        untagged.tags.set(self.tags[:1])
+        data = self.get('/api/recipes/?tags=tag0&tags=tag1')
+        self.assertEqual(
+            [recipe['id'] for recipe in data['results']], [tagged.pk],
+        )
+        response = self.client.get('/api/recipes/?tags=unknown')
+        self.assertEqual(response.status_code, 400)
+
+    def test_tags_version_changed(self):
+        '''Новый словарь тегов посреди запроса не ломает фильтр.'''
+        recipe = self.create_recipes(1)[0]
+        tag_ids = {tag.slug: tag.pk for tag in self.tags}
+        with mock.patch('api.filters.get_tag_ids',
+                        side_effect=[tag_ids, {}]):
+            data = self.get('/api/recipes/?tags=tag0')
+        self.assertEqual(
+            [recipe['id'] for recipe in data['results']], [recipe.pk],
+        )
+
+
+class ImageFieldTest(APITestCase):
+    '''Декодирование изображений и ссылки на их варианты.'''
+
+    def test_decode_wrapped_base64(self):
+        buffer = BytesIO()
+        Image.new('RGB', (2, 2)).save(buffer, 'PNG')
+        encoded = base64.b64encode(buffer.getvalue()).decode()
+        wrapped = '\n'.join(
+            encoded[start:start + 76] for start in range(0, len(encoded), 76)
+        )
+        file = Base64ImageField().decode(
+            f'data:image/png;base64,{wrapped}\n',
+        )
+        self.assertEqual(file.read(), buffer.getvalue())
+        file.close()
+
+    def test_decode_extension_case(self):
+        '''Одно содержимое с типом в разном регистре — один файл.'''
+        names = set()
+        for header in ('data:image/PNG', 'data:image/png'):
+            file = Base64ImageField().decode(f'{header};base64,cG5n')
+            names.add(file.name)
+            file.close()
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names.pop().endswith('.png'))
+
+    def test_existing_image_touched(self):
+        '''Повторно загруженное изображение не удалит collect_images.'''
+        name = default_storage.save('recipes/images/same.png',
+                                    ContentFile(b'png'))
+        path = default_storage.path(name)
+        os.utime(path, (0, 0))
+        field = RecipeSerializer().fields['image']
+        self.assertEqual(field.existing_name(ContentFile(b'', 'same.png')),
+                         name)
+        self.assertGreater(os.path.getmtime(path), 0)
+
+    def test_variants_single_exists_call(self):
+        with mock.patch('api.fields.default_storage.exists',
+                        return_value=False) as exists:
+            variants = image_variants('recipes/images/a.png', '/a.png')
+        self.assertEqual(exists.call_count, 1)
+        self.assertEqual(set(variants.values()), {'/a.png'})
+
+
+class CacheInvalidationTest(APITestCase):
+    '''Кэш сбрасывается только после коммита транзакции.'''
+
+    def test_recipe_invalidated_on_commit(self):
+        recipe = self.create_recipes(1)[0]
+        versions = get_recipe_versions([recipe.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.name = 'Новое название'
+            recipe.save()
+            self.assertEqual(get_recipe_versions([recipe.pk]), versions)
+        self.assertNotEqual(get_recipe_versions([recipe.pk]), versions)
+        data = self.client.get(f'/api/recipes/{recipe.pk}/').json()
+        self.assertEqual(data['name'], 'Новое название')
+
+    def test_lost_version(self):
+        '''Вытесненная версия не возвращается к прежнему значению
+        и не открывает старые записи.
+        '''
+        recipe = self.create_recipes(1)[0]
+        url = f'/api/recipes/{recipe.pk}/'
+        self.client.get(url)
+        tag_version = get_version(Tag)
+        Recipe.objects.filter(pk=recipe.pk).update(name='Без сигналов')
+        cache.delete_many([
+            recipe_version_key(recipe.pk), version_key(Tag),
+        ])
+        self.assertNotEqual(get_version(Tag), tag_version)
+        self.assertEqual(self.client.get(url).json()['name'], 'Без сигналов')
+
+
+class UserQueriesTest(APITestCase):
+    '''Число запросов к БД не зависит от числа подписок и рецептов.'''
+
+    def subscribe(self, count):
+        for number in range(count):
+            author = self.create_user(f'author{count}{number}')
+            Follow.objects.create(user=self.user, author=author)
+            self.create_recipes(4, author=author)
+
+    def test_subscriptions(self):
+        self.subscribe(1)
+        with self.assertNumQueries(4):
+            self.get('/api/users/subscriptions/?recipes_limit=2')
+        self.subscribe(3)
+        with self.assertNumQueries(4):
+            data = self.get('/api/users/subscriptions/?recipes_limit=2')
+        self.assertEqual(data['count'], 5)
+        for author in data['results']:
+            self.assertTrue(author['is_subscribed'])
+            self.assertLessEqual(len(author['recipes']), 2)
+
+    def test_user_detail(self):
+        with self.assertNumQueries(2):
+            data = self.get(f'/api/users/{self.author.pk}/')
+        self.assertTrue(data['is_subscribed'])
+
+
+FULL_SCAN = re.compile(r'Seq Scan on (\w+)|\bSCAN (\w+)')
+
+
+class ExplainTest(APITestCase):
+    '''Проверяет по EXPLAIN, что ленты авторов, подписки и фильтры
+    используют индексы. На PostgreSQL последовательное сканирование
+    отключается, чтобы на тестовых данных планировщик всё равно
+    выбирал индексы.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.create_recipes(3)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def unique_index(self, model, name):
+        '''Имя индекса UniqueConstraint: SQLite создаёт его сам.'''
+        if connection.vendor == 'sqlite':
+            return f'sqlite_autoindex_{model._meta.db_table}_'
+        return name
+
+    def assertUsesIndex(self, queryset, index):
+        self.assertIn(index, queryset.explain())
+
+    def test_author_feed(self):
+        self.assertUsesIndex(
+            Recipe.objects.filter(author=self.author).order_by('-id')[:6],
+            'recipe_author_idx',
+        )
+
+    def test_followers(self):
+        self.assertUsesIndex(
+            Follow.objects.filter(author=self.author).values('user'),
+            'follow_author_user_idx',
+        )
+        self.assertUsesIndex(
+            User.objects.filter(following__author=self.author),
+            'follow_author_user_idx',
+        )
+
+    def test_user_relations(self):
+        for model, name in (
+            (Follow, 'unique_follow'),
+            (Favorite, 'unique_favorite'),
+            (ShoppingCart, 'unique_shopping_cart'),
+        ):
+            with self.subTest(model=model.__name__):
+                self.assertUsesIndex(
+                    model.objects.filter(user=self.user).values('pk'),
+                    self.unique_index(model, name),
+                )
+
+    def full_scans(self, queryset):
+        return {
+            postgres or sqlite
+            for postgres, sqlite in FULL_SCAN.findall(queryset.explain())
+        }
+
+    def test_recipe_filters(self):
+        '''Полный просмотр допускается только для таблицы рецептов
+        без фильтра по автору.
+        '''
+        request = RequestFactory().get('/')
+        request.user = self.user
+        recipe_params = {
+            'tags': ['tag0', 'tag1'],
+            'author': [str(self.author.pk)],
+            'is_favorited': ['1'],
+            'is_in_shopping_cart': ['1'],
+        }
+        for size in range(len(recipe_params) + 1):
+            for names in itertools.combinations(recipe_params, size):
+                params = QueryDict(mutable=True)
+                for name in names:
+                    params.setlist(name, recipe_params[name])
+                queryset = RecipeFilter(
+                    params, queryset=Recipe.objects.all(), request=request,
+                ).qs[:6]
+                allowed = set() if 'author' in names else {'recipes_recipe'}
+                with self.subTest(params=params.urlencode()):
+                    self.assertLessEqual(self.full_scans(queryset), allowed)
+
+    def test_ingredient_search(self):
+        '''Индекс по триграммам есть только на PostgreSQL и работает
+        с трёх символов.
+        '''
+        for value in ('И', 'Инг'):
+            queryset = IngredientFilter(
+                {'name': value}, queryset=Ingredient.objects.all(),
+            ).qs
+            allowed = set()
+            if connection.vendor != 'postgresql' or len(value) < 3:
+                allowed = {'recipes_ingredient'}
+            with self.subTest(name=value):
+                self.assertLessEqual(self.full_scans(queryset), allowed)
+
+
+class LoadDataTest(APITestCase):
+    '''Загрузка ингредиентов командой load_data из json и csv.'''
+
+    FILES = {
+        'ingredients.json': (
+            '[{"name": "Ингредиент 0", "measurement_unit": "г"},\n'
+            ' {"name": "Соль", "measurement_unit": "г"},\n'
+            ' {"name": "Молоко", "measurement_unit": "мл"}]\n'
+        ),
+        'ingredients.csv': 'Ингредиент 0,г\nСоль,г\n\nМолоко,мл\n',
+    }
+
+    def load(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        output = StringIO()
+        with redirect_stdout(output):
+            call_command('load_data', path, chunk_size=2)
+        return output.getvalue().splitlines()[-1]
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_load(self):
+        for name, text in self.FILES.items():
+            with self.subTest(name=name):
+                self.assertEqual(
+                    self.load(name, text), 'Добавлено 2 из 3 ингредиентов',
+                )
+                self.assertEqual(
+                    set(Ingredient.objects.values_list(
+                        'name', 'measurement_unit',
+                    ).filter(name__in=['Соль', 'Молоко'])),
+                    {('Соль', 'г'), ('Молоко', 'мл')},
+                )
+                self.assertEqual(
+                    self.load(name, text), 'Добавлено 0 из 3 ингредиентов',
+                )
+                Ingredient.objects.filter(
+                    name__in=['Соль', 'Молоко'],
+                ).delete()
+
+    def test_malformed_json(self):
+        for text in (
+            '',
+            '{"name": "Соль", "measurement_unit": "г"}',
+            '[{"name": "Соль", "measurement_unit": "г"}',
+            '[{"name": "Соль", "measurement_unit": "г"}'
+            ' {"name": "Сахар", "measurement_unit": "г"}]',
+            '[{"name": "Соль", "measurement_unit": "г"},]',
+            '[{"name": "Соль", "measurement_unit": "г"}] []',
+            '[{"name": "Соль", "measurement_unit": }]',
+        ):
+            with self.subTest(text=text):
+                with self.assertRaises(CommandError):
+                    self.load('ingredients.json', text)
+        self.assertFalse(Ingredient.objects.filter(name='Сахар').exists())
+
+
+class MetricsTest(APITestCase):
+    '''Заголовок Server-Timing и бюджет запросов к БД.'''
+
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.create_recipes(2)
+
+    def request(self):
+        cache.clear()
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_disabled(self):
+        self.assertNotIn('Server-Timing', self.request())
+        self.assertEqual(registry.expose().count('_count{'), 0)
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_server_timing(self):
+        response = self.request()
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="\d+ queries", '
+            r'serialization;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+        self.assertIn(
+            'foodgram_db_queries_count{view="RecipeViewSet.list"} 1',
+            self.client.get('/metrics').content.decode(),
+        )
+
+    @override_settings(QUERY_BUDGET=1)
+    def test_budget(self):
+        with self.assertLogs('foodgram.metrics', 'WARNING') as logs:
+            response = self.request()
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(len(logs.records), 1)
+        self.assertRegex(
+            logs.records[0].getMessage(),
+            r'^RecipeViewSet\.list: \d+ запросов к БД при бюджете 1$',
+        )
+        self.assertIn(
+            'foodgram_query_budget_exceeded_total'
+            '{view="RecipeViewSet.list"} 1',
+            registry.expose(),
+        )
+
+    @override_settings(QUERY_BUDGET=1, QUERY_BUDGET_STRICT=True)
+    def test_strict_budget(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.request()
+
+
+class AsyncViewsTest(APITestCase):
+    '''Асинхронные представления отдают те же байты, что и DRF,
+    а остальные запросы передают синхронным представлениям.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.recipes = self.create_recipes(3)
+        self.key = Token.objects.get(user=self.user).key
+
+    def sync_get(self, url, authorized, **headers):
+        cache.clear()
+        client = self.client if authorized else APIClient()
+        return client.get(url, **headers)
+
+    def async_get(self, url, authorized, **headers):
+        cache.clear()
+        if authorized:
+            headers['authorization'] = f'Token {self.key}'
+
+        async def get():
+            return await AsyncClient().get(url, **headers)
+
+        with override_settings(ROOT_URLCONF=__name__):
+            return async_to_sync(get)()
+
+    def assertSameContent(self, url, authorized):
+        expected = self.sync_get(url, authorized)
+        response = self.async_get(url, authorized)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        return response
+
+    def test_same_content(self):
+        pk = self.recipes[0].pk
+        urls = [
+            '/api/recipes/',
+            '/api/recipes/?page=2&limit=2',
+            '/api/recipes/?tags=tag0&is_favorited=1&is_in_shopping_cart=1',
+            f'/api/recipes/?author={self.author.pk}',
+            f'/api/recipes/{pk}/',
+            '/api/ingredients/',
+            '/api/ingredients/?' + urlencode({'name': 'Ингредиент 1'}),
+            '/api/tags/',
+        ]
+        for url in urls:
+            for authorized in (False, True):
+                with self.subTest(url=url, authorized=authorized):
+                    response = self.assertSameContent(url, authorized)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertNotIsInstance(response, Response)
+
+    def test_flags(self):
+        pk = self.recipes[0].pk
+        for authorized in (False, True):
+            data = self.async_get(f'/api/recipes/{pk}/', authorized).json()
+            self.assertIs(data['is_favorited'], authorized)
+            self.assertIs(data['is_in_shopping_cart'], authorized)
+            self.assertIs(data['author']['is_subscribed'], authorized)
+
+    def test_fallback(self):
+        '''Курсоры, ошибки, ?format и неизвестные рецепты отдаёт DRF.'''
+        urls = [
+            '/api/recipes/?cursor=',
+            '/api/recipes/?page=abc',
+            '/api/recipes/?page=99',
+            '/api/recipes/?author=abc',
+            '/api/recipes/?format=json',
+            f'/api/recipes/{self.recipes[0].pk}/?format=json',
+            '/api/recipes/999/',
+            '/api/tags/?format=json',
+        ]
+        for url in urls:
+            for authorized in (False, True):
+                with self.subTest(url=url, authorized=authorized):
+                    response = self.assertSameContent(url, authorized)
+                    self.assertIsInstance(response, Response)
+
+    def test_browsable_api_fallback(self):
+        response = self.async_get(
+            '/api/tags/', False, accept='text/html',
+        )
+        self.assertIsInstance(response, Response)
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+
+
+@override_settings(
+    ALLOWED_HOSTS=['testserver'],
+    DATABASE_REPLICAS=['replica'],
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    },
+)
+class ReplicaTest(TransactionTestCase):
+    '''Чтение с реплики и с основной БД после записи клиента.
+    Реплика — зеркало тестовой БД через TEST MIRROR, как при DB_REPLICAS.
+    TransactionTestCase нужен, чтобы второе соединение видело данные,
+    а '__all__' — потому что псевдоним добавляется уже после проверок
+    тестового раннера.
+    '''
+
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        default = connections['default'].settings_dict
+        connections.settings['replica'] = {
+            **default, 'TEST': {**default['TEST'], 'MIRROR': 'default'},
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+
+    def setUp(self):
+        patcher = mock.patch('api.signals.schedule_variants')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        replicas.replicas_down.clear()
+        self.addCleanup(replicas.replicas_down.clear)
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass',
+        )
+        self.recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Текст', cooking_time=10,
+            image='recipes/images/test.png',
+        )
+        self.writer = self.token_client('writer')
+        self.reader = self.token_client('reader')
+
+    def token_client(self, name):
+        user = User.objects.create_user(
+            username=name, email=f'{name}@example.com', password='pass',
+        )
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user)}',
+        )
+        return client
+
+    def replica_queries(self, client):
+        '''Число запросов списка рецептов, ушедших на реплику.'''
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+        return len(queries)
+
+    def test_read_after_write(self):
+        self.assertGreater(self.replica_queries(self.writer), 0)
+        response = self.writer.post(
+            f'/api/recipes/{self.recipe.pk}/favorite/',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.replica_queries(self.writer), 0)
+        self.assertGreater(self.replica_queries(self.reader), 0)
+        self.assertGreater(self.replica_queries(APIClient()), 0)
+
+    def test_replica_error(self):
+        def fail(execute, sql, params, many, context):
+            raise OperationalError('replica is down')
+
+        with connections['replica'].execute_wrapper(fail):
+            with self.assertLogs('foodgram.replicas', 'WARNING'):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.reader.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertGreater(len(queries), 0)
+        self.assertIn('replica', replicas.replicas_down)
+        self.assertEqual(self.replica_queries(self.reader), 0)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework import routers
 
@@ -10,7 +11,21 @@ v1_router.register('ingredients', IngredientViewSet, basename='ingredients')
 v1_router.register('tags', TagViewSet, basename='tags')
 v1_router.register('users', UserViewSet, basename='users')
 
-urlpatterns = [
+urlpatterns = []
+
+if settings.ASYNC_API:
+    from . import async_views
+
+    urlpatterns += [
+        path('recipes/', async_views.recipe_list, name='recipes-list'),
+        path('recipes/<int:pk>/', async_views.recipe_detail,
+             name='recipes-detail'),
+        path('ingredients/', async_views.ingredient_list,
+             name='ingredients-list'),
+        path('tags/', async_views.tag_list, name='tags-list'),
+    ]
+
+urlpatterns += [
     path('', include(v1_router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
 ]
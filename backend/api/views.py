@@ -1,41 +1,110 @@
-from io import BytesIO
-
-from django.db.models import Sum
-from django.http import FileResponse
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Prefetch, Value
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
-from recipes.models import (Favorite, Ingredient, IngredientAmount, Recipe,
-                            ShoppingCart, Tag)
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from users.models import Follow, User
 
+from .cache import (cache_timeout, get_recipe_versions, get_user_relation_ids,
+                    get_version)
+from .exporters import EXPORTERS, shopping_cart_ingredients
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import LimitPageNumberPagination
+from .mixins import CachedResponseMixin
+from .pagination import FeedPagination, get_recipes_limit
 from .permissions import AuthorOrReadOnly
-from .serializers import (FavoriteSerializer, IngredientSerializer,
-                          RecipeSerializer, ShoppingCartSerializer,
+from .relations import (add_relation, add_relations, batch_results,
+                        remove_relation, remove_relations)
+from .renderers import CSVRenderer, PlainTextRenderer
+from .representations import recipes_representation
+from .serializers import (BatchSerializer, FavoriteSerializer,
+                          IngredientSerializer, RecipeSerializer,
+                          ShoppingCartSerializer, ShoppingListSerializer,
                           SubscriptionSerializer, TagSerializer,
                           UserSerializer)
 
 
+def get_recipes_data(request, pks):
+    '''Возвращает представления рецептов из кэша.
+    Рецепты, которых нет в кэше, собираются recipes_representation
+    без сериализаторов DRF.
+    Флаги текущего пользователя берутся из его закэшированных множеств.
+    '''
+    user = request.user
+    versions = get_recipe_versions(pks)
+    prefix = ':'.join((
+        'recipe',
+        request.build_absolute_uri('/'),
+        str(get_version(Tag)),
+        str(get_version(Ingredient)),
+    ))
+    keys = {
+        pk: f'{prefix}:{pk}:{version}' for pk, version in versions.items()
+    }
+    cached = cache.get_many(keys.values())
+    missing = [pk for pk, key in keys.items() if key not in cached]
+    if missing:
+        fresh = {
+            keys[item['id']]: item
+            for item in recipes_representation(missing, request)
+        }
+        cache.set_many(fresh, cache_timeout())
+        cached.update(fresh)
+    favorites = get_user_relation_ids(user, Favorite)
+    shopping_cart = get_user_relation_ids(user, ShoppingCart)
+    follows = get_user_relation_ids(user, Follow)
+    data = []
+    for pk in pks:
+        item = cached[keys[pk]]
+        item['is_favorited'] = pk in favorites
+        item['is_in_shopping_cart'] = pk in shopping_cart
+        item['author']['is_subscribed'] = item['author']['id'] in follows
+        data.append(item)
+    return data
+
+
 class RecipeViewSet(viewsets.ModelViewSet):
     '''Viewset модели Recipe.'''
+    use_replica = True
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
-    pagination_class = LimitPageNumberPagination
+    pagination_class = FeedPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     permission_classes = (IsAdminUser | AuthorOrReadOnly,)
 
+    def get_queryset(self):
+        if self.action in ('update', 'partial_update'):
+            return Recipe.objects.with_related_for_api(self.request.user)
+        return super().get_queryset()
+
+    def get_recipes_data(self, recipes):
+        return get_recipes_data(
+            self.request, [recipe.pk for recipe in recipes],
+        )
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset().only('pk'))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(self.get_recipes_data(queryset))
+        return self.get_paginated_response(self.get_recipes_data(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return Response(self.get_recipes_data([instance])[0])
+
     def create_relation(self, request, model, serializer_class):
         '''Создаёт отношение между объектом запроса и моделью.'''
         recipe = self.get_object()
-        user = request.user
-        verbose_name = model._meta.verbose_name
-        if model.objects.filter(user=user, recipe=recipe):
+        if not add_relation(model, user=request.user, recipe=recipe):
+            verbose_name = model._meta.verbose_name
             return Response(
                 {'errors': f'already in {verbose_name}'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -44,8 +113,6 @@ class RecipeViewSet(viewsets.ModelViewSet):
             recipe,
             context={'request': request}
         )
-        f = model.objects.create(user=user, recipe=recipe)
-        f.save()
         return Response(
             serializer.data,
             status=status.HTTP_201_CREATED
@@ -54,13 +121,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def delete_relation(self, request, model):
         '''Удаляет отношение между объектом запроса и моделью.'''
         recipe = self.get_object()
-        user = request.user
-        relations = model.objects.filter(
-            user=user,
-            recipe=recipe
-        )
-        if relations:
-            relations.delete()
+        if remove_relation(model, user=request.user, recipe=recipe):
             return Response(status=status.HTTP_204_NO_CONTENT)
         verbose_name = model._meta.verbose_name
         return Response(
@@ -68,6 +129,33 @@ class RecipeViewSet(viewsets.ModelViewSet):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    def batch_relation(self, request, model):
+        '''Создаёт или удаляет отношения с несколькими рецептами.'''
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        found = set(Recipe.objects.filter(pk__in=ids).order_by().values_list(
+            'pk', flat=True,
+        ))
+        verbose_name = model._meta.verbose_name
+        if request.method == 'POST':
+            changed = add_relations(
+                model, 'recipe', found, user=request.user,
+            )
+            results = batch_results(
+                ids, found, changed, status.HTTP_201_CREATED,
+                f'already in {verbose_name}',
+            )
+        else:
+            changed = remove_relations(
+                model, 'recipe', found, user=request.user,
+            )
+            results = batch_results(
+                ids, found, changed, status.HTTP_204_NO_CONTENT,
+                f'not in {verbose_name}',
+            )
+        return Response(results)
+
     @action(detail=True,
             methods=['post'],
             permission_classes=(IsAuthenticated,))
@@ -90,39 +178,45 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return response
 
     @action(detail=False,
-            methods=['get'],
+            methods=['post', 'delete'],
+            url_path='favorite/batch',
             permission_classes=(IsAuthenticated,))
+    def favorite_batch(self, request):
+        '''Добавляет в избранное или удаляет из него несколько рецептов.'''
+        return self.batch_relation(request, model=Favorite)
+
+    @action(detail=False,
+            methods=['get'],
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=(PlainTextRenderer, CSVRenderer, JSONRenderer))
     def download_shopping_cart(self, request):
-        '''Возвращает файл списка покупок.'''
-        user = request.user
-        shopping_cart = ShoppingCart.objects.filter(user=user)
-        recipes = []
-        for i in shopping_cart:
-            recipes.append(i.recipe)
-        ingredients = IngredientAmount.objects.filter(
-            recipe__in=recipes
-        ).values(
-            'ingredients__name',
-            'ingredients__measurement_unit'
-        ).annotate(Sum('amount'))
-        to_file = ['Список покупок:\n'.encode('utf-8')]
-        for i in ingredients:
-            name = i.get('ingredients__name')
-            amount = i.get('amount__sum')
-            measurment_unit = i.get('ingredients__measurement_unit')
-            to_file.append(
-                f'{name} — {amount} {measurment_unit}\n'.encode('utf-8')
-            )
-        file = BytesIO()
-        file.writelines(to_file)
-        file.seek(0)
-        response = FileResponse(
-            file,
-            as_attachment=True,
-            filename='shopping_cart.txt'
+        '''Возвращает файл списка покупок.
+        Формат выбирается query параметром format: txt, csv или json.
+        '''
+        renderer = request.accepted_renderer
+        ingredients = shopping_cart_ingredients(request.user)
+        response = StreamingHttpResponse(
+            EXPORTERS[renderer.format](ingredients),
+            content_type=f'{renderer.media_type}; charset=utf-8',
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_cart.{renderer.format}"'
         )
         return response
 
+    @action(detail=False,
+            methods=['get'],
+            permission_classes=(IsAuthenticated,))
+    def shopping_list(self, request):
+        '''Возвращает сводный список покупок.'''
+        queryset = ShoppingListItem.objects.filter(
+            user=request.user,
+        ).select_related('ingredient').order_by(
+            'ingredient__name', 'ingredient__measurement_unit',
+        )
+        serializer = ShoppingListSerializer(queryset, many=True)
+        return Response(serializer.data)
+
     @action(detail=True,
             methods=['post'],
             permission_classes=(IsAuthenticated,))
@@ -144,9 +238,20 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
         return response
 
+    @action(detail=False,
+            methods=['post', 'delete'],
+            url_path='shopping_cart/batch',
+            permission_classes=(IsAuthenticated,))
+    def shopping_cart_batch(self, request):
+        '''Добавляет в список покупок или удаляет из него
+        несколько рецептов.
+        '''
+        return self.batch_relation(request, model=ShoppingCart)
+
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     '''Viewset модели Ingredient.'''
+    use_replica = True
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
@@ -155,8 +260,9 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     '''Viewset модели Tag.'''
+    use_replica = True
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
@@ -165,14 +271,24 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
 
 class UserViewSet(DjoserUserViewSet):
     '''Viewset модели User.'''
+    use_replica = True
     serializer_class = UserSerializer
-    pagination_class = LimitPageNumberPagination
+    pagination_class = FeedPagination
 
     def get_permissions(self):
         if self.action == 'retrieve':
             self.permission_classes = [AllowAny]
         return super().get_permissions()
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_authenticated and self.action in ('list', 'retrieve'):
+            queryset = queryset.annotate(is_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+        return queryset
+
     @action(
         detail=False, methods=['get'],
         serializer_class=SubscriptionSerializer,
@@ -183,8 +299,17 @@ class UserViewSet(DjoserUserViewSet):
         В выдачу добавляются рецепты.
         '''
         user = request.user
+        latest_recipes = Recipe.objects.latest_per_author(
+            get_recipes_limit(request)
+        )
         pages = self.paginate_queryset(
-            User.objects.filter(following__user=user).order_by('pk')
+            User.objects.filter(following__user=user).annotate(
+                is_subscribed=Value(True),
+            ).order_by('pk').prefetch_related(Prefetch(
+                'recipes',
+                queryset=latest_recipes,
+                to_attr='latest_recipes',
+            ))
         )
         serializer = SubscriptionSerializer(
             pages, many=True, context={'request': request},
@@ -198,18 +323,16 @@ class UserViewSet(DjoserUserViewSet):
         '''Подписаться на пользователя.'''
         author = self.get_object()
         user = request.user
-        if user.follower.filter(user=user, author=author):
+        if user == author:
             return Response(
-                {'errors': 'already in subscribed'},
+                {'errors': 'subscribe to yourself'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        if user == author:
+        if not add_relation(Follow, user=user, author=author):
             return Response(
-                {'errors': 'subscribe to yourself'},
+                {'errors': 'already in subscribed'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        f = Follow.objects.create(user=user, author=author)
-        f.save()
         serializer = SubscriptionSerializer(
             author, context={'request': request},
         )
@@ -222,11 +345,37 @@ class UserViewSet(DjoserUserViewSet):
     def unsubscribe(self, request, id=None):
         '''Отписаться от пользователя.'''
         author = self.get_object()
-        user = request.user
-        if user.follower.filter(user=user, author=author):
-            Follow.objects.filter(user=user, author=author).delete()
+        if remove_relation(Follow, user=request.user, author=author):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'errors': 'not subscribed'},
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    @action(detail=False,
+            methods=['post', 'delete'],
+            url_path='subscribe/batch',
+            permission_classes=(IsAuthenticated,))
+    def subscribe_batch(self, request):
+        '''Подписаться на нескольких пользователей или отписаться от них.'''
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        user = request.user
+        found = set(User.objects.filter(pk__in=ids).exclude(
+            pk=user.pk,
+        ).values_list('pk', flat=True))
+        if request.method == 'POST':
+            changed = add_relations(Follow, 'author', found, user=user)
+            results = batch_results(
+                ids, found, changed, status.HTTP_201_CREATED,
+                'already in subscribed',
+                rejected={user.pk: 'subscribe to yourself'},
+            )
+        else:
+            changed = remove_relations(Follow, 'author', found, user=user)
+            results = batch_results(
+                ids, found, changed, status.HTTP_204_NO_CONTENT,
+                'not subscribed', rejected={user.pk: 'not subscribed'},
+            )
+        return Response(results)
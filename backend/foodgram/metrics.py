@@ -0,0 +1,235 @@
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseNotFound
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERIES_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+HISTOGRAMS = {
+    'request_duration_seconds': (
+        'Время обработки запроса', DURATION_BUCKETS,
+    ),
+    'db_duration_seconds': ('Время запросов к БД', DURATION_BUCKETS),
+    'serialization_duration_seconds': (
+        'Время рендеринга ответа', DURATION_BUCKETS,
+    ),
+    'db_queries': ('Число запросов к БД', QUERIES_BUCKETS),
+}
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class Histogram:
+    '''Гистограмма в памяти процесса с метками по представлениям.'''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = defaultdict(
+            lambda: [[0] * (len(buckets) + 1), 0, 0]
+        )
+
+    def observe(self, view, value):
+        series = self.series[view]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def expose(self, name):
+        for view, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                yield (f'{name}_bucket{{view="{view}",le="{bound}"}} '
+                       f'{cumulative}')
+            yield f'{name}_sum{{view="{view}"}} {total}'
+            yield f'{name}_count{{view="{view}"}} {count}'
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.histograms = {
+            name: Histogram(buckets)
+            for name, (_, buckets) in HISTOGRAMS.items()
+        }
+        self.budget_exceeded = defaultdict(int)
+
+    def observe(self, view, timings):
+        with self.lock:
+            for name, value in timings.items():
+                self.histograms[name].observe(view, value)
+
+    def expose(self):
+        lines = []
+        with self.lock:
+            for name, (description, _) in HISTOGRAMS.items():
+                metric = f'foodgram_{name}'
+                lines.append(f'# HELP {metric} {description}')
+                lines.append(f'# TYPE {metric} histogram')
+                lines.extend(self.histograms[name].expose(metric))
+            metric = 'foodgram_query_budget_exceeded_total'
+            lines.append(f'# HELP {metric} Запросы сверх бюджета')
+            lines.append(f'# TYPE {metric} counter')
+            lines.extend(
+                f'{metric}{{view="{view}"}} {count}'
+                for view, count in sorted(self.budget_exceeded.items())
+            )
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class QueryTimer:
+    '''Считает запросы к БД и их суммарное время.'''
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+
+current_timer = ContextVar('current_timer', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    '''Замеряет запрос для текущего HTTP запроса.
+    Таймер хранится в ContextVar, поэтому учитываются и запросы
+    асинхронного ORM, которые выполняются в других потоках.
+    '''
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.duration += time.perf_counter() - start
+        timer.count += 1
+
+
+def install_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_wrapper)
+for connection in connections.all():
+    install_wrapper(None, connection)
+
+
+def view_name(request):
+    '''Имя представления для меток, например RecipeViewSet.list.'''
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view = match.func
+    view_class = getattr(view, 'cls', None)
+    if view_class is None:
+        return match.view_name or view.__name__
+    actions = getattr(view, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    '''Замеряет число запросов к БД, время БД, рендеринга и всего запроса.
+    При METRICS_ENABLED значения отдаются в заголовке Server-Timing
+    и копятся в гистограммах для /metrics. Если запросов больше
+    QUERY_BUDGET, пишет предупреждение, а при QUERY_BUDGET_STRICT
+    выбрасывает QueryBudgetExceeded. Без обеих настроек не подключается:
+    заголовок раскрывал бы клиентам время работы БД.
+    У потоковых ответов не учитываются запросы при отдаче тела.
+    Работает и под WSGI, и под ASGI.
+    '''
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED and not settings.QUERY_BUDGET:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        timer = QueryTimer()
+        token = current_timer.set(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.finish(request, response, timer, start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        timer = QueryTimer()
+        token = current_timer.set(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.finish(request, response, timer, start)
+
+    def finish(self, request, response, timer, start):
+        end = time.perf_counter()
+        total = end - start
+        serialization = end - getattr(request, '_render_start', end)
+        view = view_name(request)
+        if settings.METRICS_ENABLED:
+            registry.observe(view, {
+                'request_duration_seconds': total,
+                'db_duration_seconds': timer.duration,
+                'serialization_duration_seconds': serialization,
+                'db_queries': timer.count,
+            })
+            response['Server-Timing'] = (
+                f'db;dur={timer.duration * 1000:.2f};'
+                f'desc="{timer.count} queries", '
+                f'serialization;dur={serialization * 1000:.2f}, '
+                f'total;dur={total * 1000:.2f}'
+            )
+        self.check_budget(view, timer.count)
+        return response
+
+    def process_template_response(self, request, response):
+        request._render_start = time.perf_counter()
+        return response
+
+    def check_budget(self, view, count):
+        budget = settings.QUERY_BUDGET
+        if not budget or count <= budget:
+            return
+        with registry.lock:
+            registry.budget_exceeded[view] += 1
+        message = f'{view}: {count} запросов к БД при бюджете {budget}'
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def metrics(request):
+    '''Метрики процесса в текстовом формате Prometheus.'''
+    if not settings.METRICS_ENABLED:
+        return HttpResponseNotFound()
+    return HttpResponse(
+        registry.expose(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import (DatabaseError, InterfaceError, OperationalError,
+                       connections)
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Токенов и сессий только что вошедших пользователей
+# ещё может не быть на реплике.
+PRIMARY_MODELS = {'authtoken.token', 'sessions.session'}
+
+read_replica = ContextVar('read_replica', default=None)
+
+replicas_down = {}
+
+
+class ReplicaRouter:
+    '''Отправляет чтение на реплику, выбранную ReplicaMiddleware
+    для текущего запроса, а запись и миграции на основную БД.
+    '''
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower in PRIMARY_MODELS:
+            return 'default'
+        return read_replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+def choose_replica():
+    '''Доступная реплика или None. Недоступная реплика пропускается
+    REPLICA_RETRY_SECONDS секунд.
+    '''
+    now = time.monotonic()
+    aliases = [
+        alias for alias in settings.DATABASE_REPLICAS
+        if replicas_down.get(alias, 0) <= now
+    ]
+    random.shuffle(aliases)
+    for alias in aliases:
+        connection = connections[alias]
+        try:
+            connection.close_if_health_check_failed()
+            connection.ensure_connection()
+        except DatabaseError:
+            mark_down(alias)
+            continue
+        return alias
+    return None
+
+
+def mark_down(alias):
+    logger.warning('Реплика %s недоступна, чтение идёт с основной БД', alias)
+    replicas_down[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+
+
+def client_key(request):
+    '''Ключ кэша клиента по токену или сессии, None для анонимных.'''
+    credentials = (
+        request.headers.get('Authorization')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+    digest = hashlib.sha256(credentials.encode()).hexdigest()
+    return f'primary:{digest}'
+
+
+class ReplicaMiddleware(MiddlewareMixin):
+    '''Направляет безопасные запросы к представлениям с use_replica
+    на реплики из DATABASE_REPLICAS. После успешной записи клиент
+    REPLICA_STICKY_SECONDS секунд читает с основной БД, чтобы видеть
+    свои изменения. Если реплика недоступна или отказала во время
+    запроса, чтение идёт с основной БД.
+    '''
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        token = read_replica.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_replica.reset(token)
+        key = self.written_key(request, response)
+        if key:
+            cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        token = read_replica.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_replica.reset(token)
+        key = self.written_key(request, response)
+        if key:
+            await cache.aset(key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    def written_key(self, request, response):
+        if (
+            not settings.DATABASE_REPLICAS
+            or request.method in SAFE_METHODS
+            or response.status_code >= 400
+        ):
+            return None
+        return client_key(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            not settings.DATABASE_REPLICAS
+            or request.method not in SAFE_METHODS
+            or not getattr(getattr(view_func, 'cls', None), 'use_replica',
+                           False)
+        ):
+            return None
+        key = client_key(request)
+        if key and cache.get(key):
+            return None
+        read_replica.set(choose_replica())
+        request._replica_view = (view_func, view_args, view_kwargs)
+        return None
+
+    def process_exception(self, request, exception):
+        '''Повторяет запрос на основной БД, если реплика отказала.
+        Асинхронные представления не повторяются.
+        '''
+        alias = read_replica.get()
+        view = getattr(request, '_replica_view', None)
+        if alias is None or view is None:
+            return None
+        if not isinstance(exception, (OperationalError, InterfaceError)):
+            return None
+        mark_down(alias)
+        read_replica.set(None)
+        view_func, view_args, view_kwargs = view
+        if asyncio.iscoroutinefunction(view_func):
+            return None
+        return view_func(request, *view_args, **view_kwargs)
@@ -47,4 +47,4 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(description='Follower count')
     def follower_count(self, instance):
-        return instance.followers.count()
+        return instance.favorites_count
@@ -0,0 +1,54 @@
+import os
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    '''Удаляет изображения рецептов, на которые не ссылается ни один рецепт.
+    Вместе с изображением удаляются его варианты. Перед удалением
+    ссылки на файл проверяются ещё раз: рецепт мог сослаться на него
+    уже после того, как был прочитан список изображений.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=60,
+            help='Не трогать файлы моложе указанного числа минут',
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        field = Recipe._meta.get_field('image')
+        directory = field.upload_to
+        referenced = {
+            os.path.splitext(os.path.basename(name))[0]
+            for name in Recipe.objects.values_list('image', flat=True)
+        }
+        threshold = timezone.now() - timedelta(minutes=options['min_age'])
+        removed = 0
+        for storage, subdirectory in (
+            (field.storage, directory),
+            (default_storage, os.path.join(directory, 'variants')),
+        ):
+            if not storage.exists(subdirectory):
+                continue
+            for filename in storage.listdir(subdirectory)[1]:
+                stem = os.path.splitext(filename)[0]
+                if subdirectory != directory:
+                    stem = stem.rsplit('_', 1)[0]
+                name = os.path.join(subdirectory, filename)
+                if (stem in referenced
+                        or storage.get_modified_time(name) > threshold
+                        or Recipe.objects.filter(
+                            image__contains=stem,
+                        ).exists()):
+                    continue
+                removed += 1
+                if not options['dry_run']:
+                    storage.delete(name)
+                print(f'Удалён {name}')
+        print(f'Удалено {removed} файлов')
@@ -0,0 +1,149 @@
+import random
+from itertools import accumulate
+
+from api.cache import bump_version
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import (Favorite, Ingredient, IngredientAmount, Recipe,
+                            ShoppingCart, Tag)
+from users.models import Follow, User
+
+BATCH_SIZE = 5000
+
+
+def cumulative_weights(population):
+    '''Накопленные веса для skewed: вес элемента обратен его номеру.
+    Считаются один раз на выборку, а не при каждом вызове skewed.
+    '''
+    return list(accumulate(1 / (rank + 1) for rank in range(len(population))))
+
+
+def skewed(population, cum_weights, k, rng):
+    '''Выбирает k разных элементов, первые элементы выбираются чаще.'''
+    k = min(k, len(population))
+    chosen = set()
+    while len(chosen) < k:
+        chosen.update(rng.choices(
+            population, cum_weights=cum_weights, k=k - len(chosen),
+        ))
+    return list(chosen)
+
+
+class Command(BaseCommand):
+    '''Генерирует синтетические данные для нагрузочного тестирования.
+    Популярность авторов, тегов и ингредиентов распределена неравномерно.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=8)
+        parser.add_argument('--ingredients', type=int, default=500,
+                            help='Минимальное число ингредиентов в БД')
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Избранных рецептов на пользователя')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Рецептов в корзине на пользователя')
+        parser.add_argument('--follows', type=int, default=10,
+                            help='Подписок на пользователя')
+        parser.add_argument('--password', default='benchmark')
+        parser.add_argument('--seed', type=int, default=0)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        users = self.create_users(options['users'], options['password'])
+        tags = self.create_tags(options['tags'])
+        ingredients = self.create_ingredients(options['ingredients'])
+        user_weights = cumulative_weights(users)
+        tag_weights = cumulative_weights(tags)
+        ingredient_weights = cumulative_weights(ingredients)
+        recipes = Recipe.objects.bulk_create([
+            Recipe(
+                author=skewed(users, user_weights, 1, rng)[0],
+                name=f'Рецепт {i}',
+                text='Синтетический рецепт',
+                cooking_time=rng.randint(1, 180),
+                image='recipes/images/temp.png',
+            )
+            for i in range(options['recipes'])
+        ], batch_size=BATCH_SIZE)
+        through = Recipe.tags.through
+        through.objects.bulk_create([
+            through(recipe_id=recipe.pk, tag_id=tag.pk)
+            for recipe in recipes
+            for tag in skewed(tags, tag_weights, rng.randint(1, 3), rng)
+        ], batch_size=BATCH_SIZE)
+        per_recipe = options['ingredients_per_recipe']
+        IngredientAmount.objects.bulk_create([
+            IngredientAmount(
+                recipe=recipe, ingredients=ingredient,
+                amount=rng.randint(1, 500),
+            )
+            for recipe in recipes
+            for ingredient in skewed(
+                ingredients, ingredient_weights,
+                rng.randint(1, per_recipe * 2 - 1), rng,
+            )
+        ], batch_size=BATCH_SIZE)
+        recipe_weights = cumulative_weights(recipes)
+        for model, count in (
+            (Favorite, options['favorites']),
+            (ShoppingCart, options['cart']),
+        ):
+            model.objects.bulk_create([
+                model(user=user, recipe=recipe)
+                for user in users
+                for recipe in skewed(recipes, recipe_weights, count, rng)
+            ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+        Follow.objects.bulk_create([
+            Follow(user=user, author=author)
+            for user in users
+            for author in skewed(
+                users, user_weights, options['follows'], rng,
+            )
+            if author != user
+        ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+        call_command('rebuild_counters')
+        bump_version(Tag)
+        bump_version(Ingredient)
+        print(f'Создано {len(users)} пользователей и {len(recipes)} рецептов')
+
+    def create_users(self, count, password):
+        offset = User.objects.count()
+        password = make_password(password)
+        return User.objects.bulk_create([
+            User(
+                username=f'benchmark{offset + i}',
+                email=f'benchmark{offset + i}@example.com',
+                first_name='Benchmark',
+                last_name=str(offset + i),
+                password=password,
+            )
+            for i in range(count)
+        ], batch_size=BATCH_SIZE)
+
+    def create_tags(self, count):
+        tags = list(Tag.objects.all())
+        offset = len(tags)
+        tags += Tag.objects.bulk_create([
+            Tag(
+                name=f'benchmark {offset + i}',
+                slug=f'benchmark-{offset + i}',
+                color=f'#a{offset + i:05x}',
+            )
+            for i in range(max(count - offset, 0))
+        ])
+        return tags
+
+    def create_ingredients(self, count):
+        ingredients = list(Ingredient.objects.all())
+        offset = len(ingredients)
+        ingredients += Ingredient.objects.bulk_create([
+            Ingredient(name=f'benchmark {offset + i}', measurement_unit='г')
+            for i in range(max(count - offset, 0))
+        ])
+        return ingredients
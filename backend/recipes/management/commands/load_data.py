@@ -1,29 +1,136 @@
+import csv
 import json
+import os
+import re
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from api.cache import bump_version
+from django.core.management.base import BaseCommand, CommandError
 from recipes.models import Ingredient
 
+READ_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'\s*')
+
+
+def read_json(file):
+    '''Построчно отдаёт объекты из json массива, не читая файл целиком.
+    Буфер разбирается по индексу и обрезается только при дочитывании.
+    state — что ожидается дальше: '[', первый элемент или ']',
+    элемент после запятой, ',' или ']', конец файла.
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    offset = 0
+    pos = 0
+    state = 'array'
+    eof = False
+    while True:
+        pos = WHITESPACE.match(buffer, pos).end()
+        if pos < len(buffer):
+            char = buffer[pos]
+            if state == 'array':
+                if char != '[':
+                    raise CommandError('Ожидается json массив')
+                pos += 1
+                state = 'first'
+                continue
+            if state == 'end':
+                raise CommandError(
+                    f'Лишние данные после массива, позиция {offset + pos}'
+                )
+            if state == 'separator':
+                if char not in ',]':
+                    raise CommandError(
+                        f'Ожидается , или ], позиция {offset + pos}'
+                    )
+                pos += 1
+                state = 'item' if char == ',' else 'end'
+                continue
+            if state == 'first' and char == ']':
+                pos += 1
+                state = 'end'
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as error:
+                if eof:
+                    raise CommandError(
+                        f'Ошибка json: {error.msg}, позиция {offset + pos}'
+                    )
+            else:
+                # Значение в конце буфера может продолжаться в файле.
+                if end < len(buffer) or eof:
+                    yield item
+                    pos = end
+                    state = 'separator'
+                    continue
+        elif eof:
+            if state == 'end':
+                return
+            raise CommandError('Неожиданный конец файла')
+        chunk = file.read(READ_SIZE)
+        eof = not chunk
+        offset += pos
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield {'name': row[0], 'measurement_unit': row[1]}
+
+
+READERS = {
+    '.json': read_json,
+    '.csv': read_csv,
+}
+
 
 class Command(BaseCommand):
-    '''Загружает ингредиенты в БД из ingredients.json файла.'''
+    '''Загружает ингредиенты в БД из json или csv файла.
+    Файл читается потоково, ингредиенты добавляются пачками, уже
+    существующие пропускаются.
+    '''
 
-    def handle(self, *args, **options):
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='data/ingredients.json')
+        parser.add_argument('--chunk-size', type=int, default=5000)
 
-        with open('data/ingredients.json', 'rb') as f:
-            data = json.load(f)
-        count_all = len(data)
-        objs = set()
-        for i in data:
-            name = i.get('name')
-            measurement_unit = i.get('measurement_unit')
-            if not Ingredient.objects.filter(
-                name=name,
-                measurement_unit=measurement_unit,
-            ).exists():
-                objs.add((name, measurement_unit))
-        count = len(objs)
-        uniq_objs = [
-            Ingredient(name=n, measurement_unit=m) for n, m in objs
-        ]
-        Ingredient.objects.bulk_create(uniq_objs)
+    def handle(self, *args, **options):
+        path = options['path']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только json и csv файлы')
+        count_all = 0
+        count = 0
+        with open(path, encoding='utf-8') as f:
+            rows = reader(f)
+            while chunk := list(islice(rows, options['chunk_size'])):
+                count_all += len(chunk)
+                count += self.load_chunk(chunk)
+                print(f'Обработано {count_all}, добавлено {count}')
+        bump_version(Ingredient)
         print(f'Добавлено {count} из {count_all} ингредиентов')
+
+    def load_chunk(self, chunk):
+        '''Добавляет ингредиенты, которых ещё нет в БД, и возвращает
+        число добавленных. Существующие находятся одним запросом
+        на всю пачку до вставки и после неё: ignore_conflicts молча
+        пропускает конфликтующие строки, поэтому длина списка
+        на вставку не равна числу добавленных.
+        '''
+        objs = {(row['name'], row['measurement_unit']) for row in chunk}
+        existing = self.present(objs)
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=n, measurement_unit=m)
+             for n, m in objs - existing],
+            ignore_conflicts=True,
+        )
+        return len(self.present(objs) - existing)
+
+    def present(self, objs):
+        '''Пары (название, единица) из objs, которые уже есть в БД.'''
+        return objs & set(Ingredient.objects.filter(
+            name__in={name for name, _ in objs},
+        ).values_list('name', 'measurement_unit'))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from recipes.models import (Favorite, IngredientAmount, Recipe,
+                            ShoppingListItem)
+from users.models import Follow, User
+
+
+def count_subquery(model, field):
+    '''Подзапрос количества строк model, ссылающихся на объект по field.'''
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    '''Пересчитывает денормализованные счётчики рецептов и пользователей
+    и сводные списки покупок.
+    '''
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.update(
+            favorites_count=count_subquery(Favorite, 'recipe'),
+        )
+        users = User.objects.update(
+            recipes_count=count_subquery(Recipe, 'author'),
+            followers_count=count_subquery(Follow, 'author'),
+        )
+        ShoppingListItem.objects.all().delete()
+        totals = IngredientAmount.objects.filter(
+            recipe__shopping_cart__isnull=False,
+        ).values(
+            'recipe__shopping_cart__user', 'ingredients',
+        ).annotate(total=Sum('amount')).values_list(
+            'recipe__shopping_cart__user', 'ingredients', 'total',
+        ).order_by()
+        items = ShoppingListItem.objects.bulk_create([
+            ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id, amount=amount,
+            )
+            for user_id, ingredient_id, amount in totals.iterator()
+        ], batch_size=5000)
+        print(f'Пересчитаны счётчики {recipes} рецептов '
+              f'и {users} пользователей, '
+              f'{len(items)} строк списков покупок')
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.3 on 2026-10-18 04:28
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_tags_tag_recipe_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=recipes.storage.HashedFileSystemStorage(), upload_to='recipes/images'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.1.3 on 2026-10-18 04:29
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientAmount = apps.get_model('recipes', 'IngredientAmount')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit',
+    ).annotate(keep=Min('pk'), count=Count('pk')).filter(count__gt=1)
+    for duplicate in duplicates:
+        keep = duplicate['keep']
+        others = Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(pk=keep)
+        amounts = IngredientAmount.objects.filter(ingredients__in=others)
+        amounts.filter(
+            recipe__in=IngredientAmount.objects.filter(
+                ingredients_id=keep,
+            ).values('recipe'),
+        ).delete()
+        amounts.update(ingredients_id=keep)
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_image_hashed_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
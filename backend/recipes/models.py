@@ -1,7 +1,11 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Prefetch, Subquery
+from users.models import Follow
+
+from .storage import HashedFileSystemStorage
 
 User = get_user_model()
 
@@ -14,6 +18,12 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'ingredient'
         verbose_name_plural = 'ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
@@ -40,19 +50,62 @@ class Tag(models.Model):
         return f'{self.slug}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    '''QuerySet рецептов.'''
+
+    def with_related_for_api(self, user=None):
+        '''Подгружает автора, теги и ингредиенты рецептов для API.
+        Для аутентифицированного пользователя добавляет флаги избранного,
+        корзины и подписки на автора.
+        '''
+        authors = User.objects.all()
+        queryset = self
+        if user is not None and user.is_authenticated:
+            authors = authors.annotate(is_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+            queryset = queryset.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk'),
+                )),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk'),
+                )),
+            )
+        return queryset.prefetch_related(
+            Prefetch('author', queryset=authors),
+            Prefetch('tags', queryset=Tag.objects.all()),
+            Prefetch(
+                'ingredients',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredients'
+                ),
+            ),
+        )
+
+    def latest_per_author(self, limit):
+        '''Оставляет не больше limit последних рецептов каждого автора.'''
+        latest = self.model.objects.filter(
+            author=OuterRef('author'),
+        ).order_by('-id').values('pk')[:limit]
+        return self.filter(pk__in=Subquery(latest))
+
+
 class Recipe(models.Model):
     '''Модель рецептов.'''
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        related_name='recipes'
+        related_name='recipes',
+        db_index=False,
     )
     tags = models.ManyToManyField(
         Tag,
         related_name='recipes'
     )
     image = models.ImageField(
-        upload_to='recipes/images'
+        upload_to='recipes/images',
+        storage=HashedFileSystemStorage(),
     )
     name = models.CharField(max_length=200)
     text = models.TextField()
@@ -71,11 +124,17 @@ class Recipe(models.Model):
     followers = models.ManyToManyField(User,
                                        blank=True,
                                        through='Favorite')
+    favorites_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-id']
         verbose_name = 'recipe'
         verbose_name_plural = 'recipes'
+        indexes = [
+            models.Index(fields=['author', '-id'], name='recipe_author_idx'),
+        ]
 
     def __str__(self):
         return f'{self.name}'
@@ -83,7 +142,11 @@ class Recipe(models.Model):
 
 class IngredientAmount(models.Model):
     '''Промежуточная модель ингредиентов и рецептов.'''
-    ingredients = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    ingredients = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
@@ -103,7 +166,12 @@ class IngredientAmount(models.Model):
     class Meta:
         verbose_name = 'amount of ingredients in recipe'
         verbose_name_plural = 'amount of ingredients in recipes'
-        unique_together = ['ingredients', 'recipe']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['ingredients', 'recipe'],
+                name='unique_ingredient_amount',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.ingredients.name}'
@@ -115,6 +183,7 @@ class ShoppingCart(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='shopping_cart',
+        db_index=False,
     )
     recipe = models.ForeignKey(
         Recipe,
@@ -125,7 +194,12 @@ class ShoppingCart(models.Model):
     class Meta:
         verbose_name = 'shopping cart'
         verbose_name_plural = 'shopping carts'
-        unique_together = ['user', 'recipe']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_shopping_cart',
+            ),
+        ]
 
 
 class Favorite(models.Model):
@@ -134,6 +208,7 @@ class Favorite(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='favorite',
+        db_index=False,
     )
     recipe = models.ForeignKey(
         Recipe,
@@ -143,4 +218,83 @@ class Favorite(models.Model):
     class Meta:
         verbose_name = 'favorite'
         verbose_name_plural = 'favorites'
-        unique_together = ['user', 'recipe']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_favorite',
+            ),
+        ]
+
+
+class ShoppingListQuerySet(models.QuerySet):
+    '''QuerySet сводных списков покупок.'''
+
+    def add_amounts(self, user_ids, amounts):
+        '''Прибавляет amounts {id ингредиента: количество} к спискам
+        покупок пользователей. Количество может быть отрицательным,
+        строки, в которых не осталось ингредиента, удаляются.
+        Строки пользователей блокируются, чтобы параллельные изменения
+        одного списка не затирали друг друга.
+        '''
+        amounts = {pk: amount for pk, amount in amounts.items() if amount}
+        if not user_ids or not amounts:
+            return
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(
+                pk__in=user_ids,
+            ).order_by('pk').values_list('pk'))
+            existing = {
+                (item.user_id, item.ingredient_id): item
+                for item in self.filter(
+                    user_id__in=user_ids, ingredient_id__in=amounts,
+                )
+            }
+            changed, created, removed = [], [], []
+            for user_id in user_ids:
+                for ingredient_id, amount in amounts.items():
+                    item = existing.get((user_id, ingredient_id))
+                    if item is None:
+                        if amount > 0:
+                            created.append(self.model(
+                                user_id=user_id,
+                                ingredient_id=ingredient_id,
+                                amount=amount,
+                            ))
+                    elif item.amount + amount > 0:
+                        item.amount += amount
+                        changed.append(item)
+                    else:
+                        removed.append(item.pk)
+            if removed:
+                self.filter(pk__in=removed).delete()
+            if changed:
+                self.bulk_update(changed, ['amount'])
+            if created:
+                self.bulk_create(created)
+
+
+class ShoppingListItem(models.Model):
+    '''Сумма ингредиента во всех рецептах списка покупок пользователя.'''
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        db_index=False,
+    )
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField()
+
+    objects = ShoppingListQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'shopping list item'
+        verbose_name_plural = 'shopping list items'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient.name}'
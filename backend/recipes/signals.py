@@ -0,0 +1,172 @@
+from collections import defaultdict
+
+from django.db.models import F, QuerySet, Sum
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from users.models import User
+
+from .models import (Favorite, Ingredient, IngredientAmount, Recipe,
+                     ShoppingCart, ShoppingListItem)
+
+
+def change_favorites_count(recipe_ids, delta):
+    '''Изменяет счётчик избранного у рецептов на delta.'''
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        favorites_count=F('favorites_count') + delta
+    )
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_created(sender, instance, created, raw, **kwargs):
+    '''Увеличивает счётчик избранного у рецепта.'''
+    if created and not raw:
+        change_favorites_count([instance.recipe_id], 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_deleted(sender, instance, **kwargs):
+    '''Уменьшает счётчик избранного у рецепта.'''
+    change_favorites_count([instance.recipe_id], -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, raw, **kwargs):
+    '''Увеличивает счётчик рецептов у автора.'''
+    if created and not raw:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    '''Уменьшает счётчик рецептов у автора.'''
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=F('recipes_count') - 1
+    )
+
+
+def recipe_amounts(recipe_ids, sign=1):
+    '''Суммы ингредиентов рецептов {id ингредиента: количество}.'''
+    return {
+        ingredient_id: sign * total
+        for ingredient_id, total in IngredientAmount.objects.filter(
+            recipe_id__in=recipe_ids,
+        ).values('ingredients').annotate(
+            total=Sum('amount'),
+        ).values_list('ingredients', 'total').order_by()
+    }
+
+
+def change_shopping_lists(instances, sign):
+    '''Прибавляет или вычитает ингредиенты рецептов из списков покупок.'''
+    recipes = defaultdict(list)
+    for instance in instances:
+        recipes[instance.user_id].append(instance.recipe_id)
+    for user_id, recipe_ids in recipes.items():
+        ShoppingListItem.objects.add_amounts(
+            [user_id], recipe_amounts(recipe_ids, sign),
+        )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_recipe_added(sender, instance, created, raw, **kwargs):
+    '''Добавляет ингредиенты рецепта в список покупок.'''
+    if created and not raw:
+        change_shopping_lists([instance], 1)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def cart_recipe_removed(sender, instance, origin=None, **kwargs):
+    '''Вычитает ингредиенты рецепта из списка покупок.
+    При каскадном удалении рецепта список уже обновлён в recipe_deleting,
+    а при удалении пользователя удаляется вместе с ним.
+    '''
+    origin_model = (
+        origin.model if isinstance(origin, QuerySet) else type(origin)
+    )
+    if origin_model not in (Recipe, User):
+        change_shopping_lists([instance], -1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    '''Вычитает ингредиенты удаляемого рецепта из списков покупок.'''
+    user_ids = list(ShoppingCart.objects.filter(recipe=instance).values_list(
+        'user_id', flat=True,
+    ))
+    if user_ids:
+        ShoppingListItem.objects.add_amounts(
+            user_ids, recipe_amounts([instance.pk], sign=-1),
+        )
+
+
+def change_recipe_amounts(recipe_id, amounts):
+    '''Прибавляет amounts к спискам покупок всех, у кого рецепт
+    в корзине.
+    '''
+    user_ids = list(ShoppingCart.objects.filter(
+        recipe_id=recipe_id,
+    ).values_list('user_id', flat=True))
+    if user_ids:
+        ShoppingListItem.objects.add_amounts(user_ids, amounts)
+
+
+def stored_amount(instance):
+    '''Ингредиент и количество строки, как они записаны в БД.'''
+    return IngredientAmount.objects.filter(pk=instance.pk).values_list(
+        'ingredients_id', 'amount',
+    ).first()
+
+
+@receiver(pre_save, sender=IngredientAmount)
+def amount_saving(sender, instance, raw, **kwargs):
+    '''Запоминает прежние ингредиент и количество для amount_saved.'''
+    instance.previous_amount = None
+    if instance.pk and not raw:
+        instance.previous_amount = stored_amount(instance)
+
+
+@receiver(post_save, sender=IngredientAmount)
+def amount_saved(sender, instance, raw, **kwargs):
+    '''Переносит изменение ингредиента рецепта, например из админки,
+    в списки покупок. bulk_create и bulk_update сигналов не отправляют,
+    их изменения RecipeSerializer учитывает сам.
+    '''
+    if raw:
+        return
+    amounts = defaultdict(int)
+    if instance.previous_amount:
+        ingredient_id, amount = instance.previous_amount
+        amounts[ingredient_id] -= amount
+    amounts[instance.ingredients_id] += instance.amount
+    change_recipe_amounts(instance.recipe_id, amounts)
+
+
+@receiver(pre_delete, sender=IngredientAmount)
+def amount_deleting(sender, instance, origin=None, **kwargs):
+    '''Запоминает записанные в БД значения строки, удаляемой
+    через delete() объекта: формы админки успевают изменить объект
+    перед удалением.
+    '''
+    if origin is instance:
+        instance.previous_amount = stored_amount(instance)
+
+
+@receiver(post_delete, sender=IngredientAmount)
+def amount_deleted(sender, instance, origin=None, **kwargs):
+    '''Вычитает удалённый ингредиент рецепта из списков покупок.
+    При удалении рецепта, его автора или самого ингредиента списки
+    обновляются в recipe_deleting или удаляются каскадно.
+    '''
+    origin_model = (
+        origin.model if isinstance(origin, QuerySet) else type(origin)
+    )
+    if origin_model in (Recipe, User, Ingredient):
+        return
+    ingredient_id, amount = (
+        getattr(instance, 'previous_amount', None)
+        or (instance.ingredients_id, instance.amount)
+    )
+    change_recipe_amounts(instance.recipe_id, {ingredient_id: -amount})
@@ -0,0 +1,25 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Follow, User
+
+
+def change_followers_count(author_ids, delta):
+    '''Изменяет счётчик подписчиков у авторов на delta.'''
+    User.objects.filter(pk__in=author_ids).update(
+        followers_count=F('followers_count') + delta
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw, **kwargs):
+    '''Увеличивает счётчик подписчиков у автора.'''
+    if created and not raw:
+        change_followers_count([instance.author_id], 1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    '''Уменьшает счётчик подписчиков у автора.'''
+    change_followers_count([instance.author_id], -1)